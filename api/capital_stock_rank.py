@@ -1,19 +1,25 @@
 import argparse
+import os
 import re
+import tempfile
+from datetime import date
 from pathlib import Path
 
-import adata
+import numpy as np
 import pandas as pd
 
 
 _CODE_RE = re.compile(r"^\d{6}(\.[A-Za-z]{2})?$")
 
 
-def _code_match_ratio(series: pd.Series) -> float:
-    values = series.astype(str).str.strip()
+def _code_match_ratio(values: pd.Series) -> float:
+    """Share of rows that look like stock codes; expects an already stripped str series."""
     if len(values) == 0:
         return 0.0
-    return values.str.match(_CODE_RE).mean()
+    # The same stock repeats under many concepts; only regex-check distinct values.
+    counts = values.value_counts()
+    matched = counts.index.str.fullmatch(_CODE_RE)
+    return counts[matched].sum() / len(values)
 
 
 def _pick_first_existing(df: pd.DataFrame, names: list[str]) -> str | None:
@@ -24,8 +30,6 @@ def _pick_first_existing(df: pd.DataFrame, names: list[str]) -> str | None:
 
 
 def _read_csv_preserve_codes(path: Path) -> pd.DataFrame:
-    header = pd.read_csv(path, encoding="utf-8-sig", nrows=0)
-    cols = set(header.columns.astype(str))
     force_str_cols = [
         "stock_code",
         "stock_name",
@@ -36,8 +40,35 @@ def _read_csv_preserve_codes(path: Path) -> pd.DataFrame:
         "index_name",
         "concept_code",
     ]
-    dtype = {c: str for c in force_str_cols if c in cols}
-    return pd.read_csv(path, encoding="utf-8-sig", dtype=dtype)
+    # Code columns stay strings (leading zeros kept); dtype entries for columns
+    # absent from the file are ignored, so no separate header pass is needed.
+    return pd.read_csv(path, encoding="utf-8-sig", dtype={c: str for c in force_str_cols})
+
+
+def _fetch_capital_flow(days_type: int, refresh: bool = False) -> pd.DataFrame:
+    # Same-day reruns reuse a parquet snapshot instead of hitting the adata API again.
+    cache_path = Path(tempfile.gettempdir()) / (
+        f"capital_flow_east_{days_type}_{date.today():%Y%m%d}.parquet"
+    )
+    if cache_path.exists() and not refresh:
+        try:
+            return pd.read_parquet(cache_path)
+        except Exception as exc:
+            # unreadable snapshot counts as a cache miss
+            print(f"ignoring unreadable cache {cache_path}: {exc}")
+    import adata  # heavy import; only needed when actually fetching
+
+    df = adata.stock.market.all_capital_flow_east(days_type=days_type)
+    # Write next to the final path and swap in, so an interrupted run never leaves
+    # a truncated snapshot behind; caching is best-effort.
+    tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+    try:
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, cache_path)
+    except Exception as exc:
+        print(f"failed to write cache {cache_path}: {exc}")
+        tmp_path.unlink(missing_ok=True)
+    return df
 
 
 def main() -> int:
@@ -76,6 +107,11 @@ def main() -> int:
         default=None,
         help="Optional path to save the raw fetched CSV (utf-8-sig).",
     )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Ignore today's cached API snapshot and fetch again.",
+    )
     parser.add_argument(
         "--add-count-column",
         action="store_true",
@@ -88,7 +124,7 @@ def main() -> int:
         df = _read_csv_preserve_codes(input_path)
     else:
         input_path = None
-        df = adata.stock.market.all_capital_flow_east(days_type=args.days_type)
+        df = _fetch_capital_flow(args.days_type, refresh=args.refresh)
         if args.save_raw:
             Path(args.save_raw).parent.mkdir(parents=True, exist_ok=True)
             df.to_csv(args.save_raw, index=False, encoding="utf-8-sig")
@@ -107,22 +143,21 @@ def main() -> int:
             f"Missing stock columns; got columns: {', '.join(df.columns.astype(str))}"
         )
 
-    # Some outputs have stock_code/stock_name swapped; detect for counting only.
-    stock_key_col = stock_code_col
-    if _code_match_ratio(df[stock_code_col]) < _code_match_ratio(df[stock_name_col]):
-        stock_key_col = stock_name_col
+    # Some outputs have stock_code/stock_name swapped; detect once and reuse below.
+    code_values = df[stock_code_col].astype(str).str.strip()
+    name_values = df[stock_name_col].astype(str).str.strip()
+    stock_code_is_code = _code_match_ratio(code_values) >= _code_match_ratio(name_values)
 
     work = df.copy()
     work["_orig_order"] = range(len(work))
-    stock_key = work[stock_key_col].astype(str).str.strip()
-    counts = stock_key.value_counts(dropna=False)
-    work["_stock_row_count"] = stock_key.map(counts).fillna(0).astype(int)
-    first_occurrence = (
-        pd.DataFrame({"stock_key": stock_key, "_orig_order": work["_orig_order"]})
-        .groupby("stock_key", dropna=False)["_orig_order"]
-        .min()
-    )
-    work["_stock_first_occurrence"] = stock_key.map(first_occurrence).fillna(0).astype(int)
+    stock_key = code_values if stock_code_is_code else name_values
+    # One factorize pass gives both per-stock row counts and first-occurrence positions.
+    codes, uniques = pd.factorize(stock_key)
+    counts = np.bincount(codes, minlength=len(uniques))
+    first_occurrence = np.full(len(uniques), len(codes), dtype=np.int64)
+    np.minimum.at(first_occurrence, codes, work["_orig_order"].to_numpy())
+    work["_stock_row_count"] = counts[codes]
+    work["_stock_first_occurrence"] = first_occurrence[codes]
 
     out = work.sort_values(
         ["_stock_row_count", "_stock_first_occurrence", "_orig_order"],
@@ -155,7 +190,6 @@ def main() -> int:
         "stock_row_count": "出现次数",
     }
     # Decide which stock column is "code" vs "name" (adata sometimes swaps them).
-    stock_code_is_code = _code_match_ratio(df[stock_code_col]) >= _code_match_ratio(df[stock_name_col])
     stock_renames = (
         {stock_code_col: "股票代码", stock_name_col: "股票名称"}
         if stock_code_is_code
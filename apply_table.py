@@ -1,24 +1,23 @@
 #!/usr/bin/env python3
 """
 通用 apply 脚本：把新表重命名为旧表。
-用法: python apply_table.py <新表名> <旧表名>
+用法: python apply_table.py <新表名> <旧表名> [<新表名> <旧表名> ...]
+多组表可在一次调用中完成，共用同一个进程与数据库连接。
 """
 from __future__ import annotations
 
 import argparse
 import os
-import re
 import sys
-from typing import Tuple
+import time
+from typing import List, Tuple
 
-from sqlalchemy import inspect, text
+from sqlalchemy import text
 
 # 添加当前目录到 Python 路径
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from db_handler import get_db_handler  # noqa: E402
-
-VALID_TABLE_NAME = re.compile(r"^[A-Za-z0-9_]+$")
+from db_handler import VALID_TABLE_NAME, get_db_handler  # noqa: E402
 
 
 def validate_table_name(value: str) -> str:
@@ -29,14 +28,23 @@ def validate_table_name(value: str) -> str:
     return value
 
 
-def parse_args(argv: list[str]) -> Tuple[str, str]:
+def parse_args(argv: list[str]) -> List[Tuple[str, str]]:
     parser = argparse.ArgumentParser(
         description="删除旧表并将新表重命名为旧表"
     )
     parser.add_argument("new_table", type=validate_table_name, help="新表名")
     parser.add_argument("old_table", type=validate_table_name, help="旧表名")
+    parser.add_argument(
+        "more_tables",
+        nargs="*",
+        type=validate_table_name,
+        help="更多 <新表名> <旧表名> 组",
+    )
     args = parser.parse_args(argv[1:])
-    return args.new_table, args.old_table
+    if len(args.more_tables) % 2:
+        parser.error("表名需成对出现: <新表名> <旧表名>")
+    names = [args.new_table, args.old_table, *args.more_tables]
+    return list(zip(names[::2], names[1::2]))
 
 
 def apply_table(new_table: str, old_table: str) -> bool:
@@ -51,31 +59,45 @@ def apply_table(new_table: str, old_table: str) -> bool:
     try:
         db_handler = get_db_handler()
         engine = db_handler.get_engine()
-        inspector = inspect(engine)
-
-        with engine.connect() as conn:
-            # 先检查新表是否存在：不存在则不做任何破坏性操作（不删除旧表）
-            if not inspector.has_table(new_table):
-                print(f"错误: 新表 {new_table} 不存在，取消操作（不会删除旧表 {old_table}）")
-                return False
-
-            if inspector.has_table(old_table):
-                print(f"删除旧表: {old_table} ...")
-                conn.execute(text(f"DROP TABLE `{old_table}`"))
-                conn.commit()
-                print(f"已删除 {old_table}")
-
-            print(f"重命名 {new_table} → {old_table} ...")
-            conn.execute(text(f"ALTER TABLE `{new_table}` RENAME TO `{old_table}`"))
-            conn.commit()
-            print("重命名成功")
-
-        table_lock = getattr(db_handler, "_table_lock", None)  # noqa: SLF001
-        existing_tables = getattr(db_handler, "_existing_tables", None)  # noqa: SLF001
-        if table_lock and existing_tables is not None:
-            with table_lock:
-                existing_tables.discard(new_table)
-                existing_tables.discard(old_table)
+
+        # 新旧两张表的存在性一次查询取回
+        existing = db_handler.tables_exist([new_table, old_table])
+
+        # 先检查新表是否存在：不存在则不做任何破坏性操作（不删除旧表）
+        if new_table not in existing:
+            print(f"错误: 新表 {new_table} 不存在，取消操作（不会删除旧表 {old_table}）")
+            return False
+
+        # begin(): 正常退出自动提交，异常自动回滚
+        with engine.begin() as conn:
+            if engine.dialect.name in ("mysql", "mariadb"):
+                # MySQL 多表 RENAME 是原子操作：读者不会看到旧表“消失”的窗口
+                if old_table in existing:
+                    backup_table = f"{old_table}__drop_{int(time.time())}"
+                    print(f"原子替换 {new_table} → {old_table}（旧表暂存为 {backup_table}）...")
+                    conn.execute(text(
+                        f"RENAME TABLE `{old_table}` TO `{backup_table}`, "
+                        f"`{new_table}` TO `{old_table}`"
+                    ))
+                    print("重命名成功")
+                    print(f"删除旧表: {backup_table} ...")
+                    conn.execute(text(f"DROP TABLE `{backup_table}`"))
+                    print(f"已删除 {backup_table}")
+                else:
+                    print(f"重命名 {new_table} → {old_table} ...")
+                    conn.execute(text(f"RENAME TABLE `{new_table}` TO `{old_table}`"))
+                    print("重命名成功")
+            else:
+                # 不再先 has_table 探测，由服务端条件删除
+                print(f"删除旧表（若存在）: {old_table} ...")
+                conn.execute(text(f"DROP TABLE IF EXISTS `{old_table}`"))
+
+                print(f"重命名 {new_table} → {old_table} ...")
+                conn.execute(text(f"ALTER TABLE `{new_table}` RENAME TO `{old_table}`"))
+                print("重命名成功")
+
+        # 表结构已变化，清掉已存在表缓存与共享 Inspector 的反射缓存
+        db_handler.invalidate_table_cache(new_table, old_table)
 
         print("操作完成")
         return True
@@ -86,8 +108,9 @@ def apply_table(new_table: str, old_table: str) -> bool:
 
 
 def main(argv: list[str]) -> int:
-    new_table, old_table = parse_args(argv)
-    success = apply_table(new_table, old_table)
+    success = True
+    for new_table, old_table in parse_args(argv):
+        success = apply_table(new_table, old_table) and success
     return 0 if success else 1
 
 
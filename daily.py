@@ -5,47 +5,161 @@
 import os
 import sys
 import time
+import threading
 import tushare as ts
 import pandas as pd
+from sqlalchemy import Float, String, text
 from datetime import datetime, timedelta
-import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 # 添加当前目录到Python路径
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from db_handler import get_db_handler
-
-# Suppress FutureWarning emitted by tushare.pro.data_pro about Series.fillna(method=...)
-# The warning originates inside the third-party package; we filter it here to keep logs clean.
-warnings.filterwarnings(
-    "ignore",
-    category=FutureWarning,
-    module=r"tushare\.pro\.data_pro"
+import tushare_warnings  # noqa: F401  导入即注册 tushare FutureWarning 过滤
+
+# 并发拉取的线程数（受 tushare 每分钟调用次数限制，不宜过大）
+DEFAULT_WORKERS = 4
+# tushare 日线接口每分钟调用上限
+CALLS_PER_MINUTE = 500
+# 限流器允许的突发调用数：任意 60 秒内最多 突发 + 60 秒补充量 = CALLS_PER_MINUTE 次
+BURST_CALLS = 10
+# 每攒够多少个交易日写一次库
+INSERT_BATCH_DATES = 10
+
+# 日线列类型：取回后统一转换，写库时直接声明 SQL 类型，不再逐批推断
+# 价格/成交额保持 float64，float32 只有约 7 位有效数字，成交额会失真
+DAILY_FLOAT_COLUMNS = ['open', 'high', 'low', 'close', 'pre_close', 'change', 'pct_chg', 'vol', 'amount']
+DAILY_DTYPES = {'ts_code': 'string', 'trade_date': 'string', **{c: 'float64' for c in DAILY_FLOAT_COLUMNS}}
+DAILY_SQL_TYPES = {
+    'ts_code': String(20),
+    'trade_date': String(20),
+    **{c: Float(precision=53) for c in DAILY_FLOAT_COLUMNS},
+}
+
+# 交易日历本地缓存（完整日历，含休市日，按区间筛选）
+TRADE_CAL_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "tushare-sync", "trade_cal_sse.parquet")
+
+# 一次性预取区间内已存在的交易日（绑定参数，语句文本固定）
+# DISTINCT 交给数据库在 trade_date 索引上去重，只返回每个交易日一行
+EXISTING_DATES_SQL = text(
+    "SELECT DISTINCT trade_date FROM daily WHERE trade_date BETWEEN :start_date AND :end_date"
 )
 
+def _read_trade_cal_cache():
+    """读取本地交易日历缓存（不存在或损坏时返回 None）"""
+    if not os.path.isfile(TRADE_CAL_CACHE):
+        return None
+    try:
+        return pd.read_parquet(TRADE_CAL_CACHE)
+    except Exception as e:
+        print(f"读取交易日历缓存失败，将重新获取: {e}")
+        return None
+
 def get_trade_dates(pro, start_date, end_date):
-    """获取交易日历"""
+    """获取交易日历（本地缓存覆盖所需区间时不再请求 tushare）"""
+    fetch_start, fetch_end = start_date, end_date
+    cached = _read_trade_cal_cache()
+    if cached is not None and not cached.empty:
+        cache_start = cached['cal_date'].min()
+        cache_end = cached['cal_date'].max()
+        if cache_start <= start_date and cache_end >= end_date:
+            return _open_dates_between(cached, start_date, end_date)
+        # 与已有缓存合并成连续区间，避免缓存出现空洞
+        fetch_start, fetch_end = min(start_date, cache_start), max(end_date, cache_end)
+
     try:
         trade_cal = pro.trade_cal(
             exchange='SSE',
-            is_open='1',
-            start_date=start_date,
-            end_date=end_date,
-            fields='cal_date'
+            start_date=fetch_start,
+            end_date=fetch_end,
+            fields='cal_date,is_open'
         )
-        return trade_cal['cal_date'].tolist()
+        trade_cal = trade_cal.astype({'cal_date': str, 'is_open': int})
+        try:
+            os.makedirs(os.path.dirname(TRADE_CAL_CACHE), exist_ok=True)
+            trade_cal.to_parquet(TRADE_CAL_CACHE, index=False)
+        except Exception as e:
+            print(f"写入交易日历缓存失败: {e}")
+        return _open_dates_between(trade_cal, start_date, end_date)
     except Exception as e:
         print(f"获取交易日历失败: {e}")
         return []
 
+def _open_dates_between(trade_cal, start_date, end_date):
+    """从完整日历中筛出区间内的开市日"""
+    mask = (
+        (trade_cal['cal_date'] >= start_date)
+        & (trade_cal['cal_date'] <= end_date)
+        & (trade_cal['is_open'] == 1)
+    )
+    return trade_cal.loc[mask, 'cal_date'].sort_values().tolist()
+
+class TokenBucket:
+    """线程安全的令牌桶限流器：允许突发，令牌耗尽时才等待"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._base_rate = rate
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._slow_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if self._slow_until and now >= self._slow_until:
+            # 降速期结束，恢复原速率
+            self.rate = self._base_rate
+            self._slow_until = 0.0
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """取一个令牌，不足时睡到下一个令牌产生"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def slow_down(self, seconds=60):
+        """触发接口限流后，在接下来一段时间内把速率减半并清空已积累的令牌"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.rate / 2, self._base_rate / 64)
+            self._tokens = 0
+            self._slow_until = time.monotonic() + seconds
+
+# 进程内共享的限流器（并发线程共用同一份配额）
+# 满桶启动时首个 60 秒可用 capacity + rate*60 次，两者之和按 CALLS_PER_MINUTE 分配，冷启动也不超限
+limiter = TokenBucket(rate=(CALLS_PER_MINUTE - BURST_CALLS) / 60, capacity=BURST_CALLS)
+
+def _is_rate_limited(error):
+    """判断异常是否为 tushare 的访问频率限制"""
+    message = str(error)
+    return "最多访问" in message or "429" in message
+
 def get_daily_data(pro, trade_date, max_retries=3):
     """获取日线数据"""
     for attempt in range(max_retries):
         try:
+            limiter.acquire()
             print(f"获取 {trade_date} 日线数据...")
             df = pro.daily(trade_date=trade_date)
-            return df
+            if df is None:
+                return pd.DataFrame()
+            # 只转换实际返回的列，接口增删字段时不报错
+            return df.astype({c: t for c, t in DAILY_DTYPES.items() if c in df.columns})
         except Exception as e:
+            if _is_rate_limited(e):
+                print("触发接口频率限制，限流速率减半 60 秒")
+                limiter.slow_down()
             if attempt < max_retries - 1:
                 wait_time = (attempt + 1) * 2
                 print(f"获取失败，{wait_time}秒后重试...")
@@ -54,30 +168,138 @@ def get_daily_data(pro, trade_date, max_retries=3):
                 print(f"获取 {trade_date} 数据失败: {e}")
     return pd.DataFrame()
 
-def sync_daily():
-    """同步日线数据"""
+def fetch_daily_task(pro, trade_date):
+    """线程任务：获取单日数据（调用频率由共享令牌桶控制）"""
+    return get_daily_data(pro, trade_date)
+
+def sync_trade_dates(pro, db_handler, trade_dates, existing_dates, max_workers=DEFAULT_WORKERS):
+    """多线程并发拉取各交易日数据，主线程按批次合并写库"""
+    total_records = 0
+    success_dates = []
+
+    pending_dates = []
+    for trade_date in trade_dates:
+        # 跳过已存在的日期（使用内存集合判断，快速）
+        if trade_date in existing_dates:
+            print(f"{trade_date} 数据已存在，跳过")
+        else:
+            pending_dates.append(trade_date)
+
+    # 多个交易日的数据攒成一批后再写库，减少临时表/事务次数
+    batch_frames = []
+    batch_dates = []
+
+    def flush_batch():
+        nonlocal total_records
+        if not batch_frames:
+            return True
+        batch_df = pd.concat(batch_frames, ignore_index=True)
+        record_id = f"{batch_dates[0]}~{batch_dates[-1]}"
+        # 插入数据库（insert_data 内部会负责创建表）；写库只在主线程进行
+        ok = db_handler.insert_data('daily', batch_df, record_id, dtype=DAILY_SQL_TYPES)
+        if ok:
+            total_records += len(batch_df)
+            success_dates.extend(batch_dates)
+            print(f"{record_id} 共 {len(batch_dates)} 个交易日写入完成，{len(batch_df)} 条记录")
+        else:
+            print(f"{record_id} 批量写入失败")
+        batch_frames.clear()
+        batch_dates.clear()
+        return ok
+
+    # 并发拉取，但严格按交易日顺序消费与写库：下次从库中最大日期续传，
+    # 不能让较晚的日期先落库而较早的日期因中断/失败缺失
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        in_flight = deque()
+        dates_iter = iter(pending_dates)
+        max_in_flight = max(1, max_workers) * 2
+
+        def submit_next():
+            trade_date = next(dates_iter, None)
+            if trade_date is not None:
+                in_flight.append((trade_date, executor.submit(fetch_daily_task, pro, trade_date)))
+
+        for _ in range(max_in_flight):
+            submit_next()
+
+        while in_flight:
+            trade_date, future = in_flight.popleft()
+            submit_next()
+            try:
+                df = future.result()
+            except Exception as e:
+                print(f"同步 {trade_date} 失败: {e}")
+                continue
+            if df.empty:
+                print(f"{trade_date} 数据为空，跳过")
+                continue
+
+            batch_frames.append(df)
+            batch_dates.append(trade_date)
+            print(f"{trade_date} 获取完成，{len(df)} 条记录")
+            if len(batch_dates) >= INSERT_BATCH_DATES and not flush_batch():
+                # 写库失败后停止写入更晚的日期，下次运行从已写入的最大日期续传
+                for _, pending in in_flight:
+                    pending.cancel()
+                print("批量写入失败，停止写入之后的交易日")
+                return total_records, success_dates
+
+    flush_batch()
+    return total_records, success_dates
+
+def _sync_range(pro, db_handler, start_date, end_date, max_workers=DEFAULT_WORKERS):
+    """同步区间内的日线数据（预取已存在日期 → 并发拉取 → 批量写库）
+
+    返回 (total_records, success_dates)；区间内没有交易日时返回 None。
+    """
+    # 获取交易日
+    trade_dates = get_trade_dates(pro, start_date, end_date)
+    if not trade_dates:
+        return None
+
+    print(f"共需同步 {len(trade_dates)} 个交易日")
+
+    # 预取已存在的 trade_date 列表，避免在循环中反复查询数据库
+    existing_dates = set()
+    try:
+        # 单列结果直接按标量迭代，不经 DataFrame
+        with db_handler.get_engine().connect() as conn:
+            rows = conn.execute(EXISTING_DATES_SQL, {"start_date": start_date, "end_date": end_date}).scalars()
+            # 保持与 tushare 返回的一致格式（通常是字符串 YYYYMMDD）
+            existing_dates = {str(d) for d in rows}
+        if existing_dates:
+            print(f"已预取 {len(existing_dates)} 条已存在的日期，循环中将跳过它们")
+    except Exception as e:
+        # 如果表不存在或查询失败，existing_dates 保持为空，之后 insert_data 会负责创建表
+        print(f"未能预取已存在的日期（表可能不存在），将逐个插入: {e}")
+
+    return sync_trade_dates(pro, db_handler, trade_dates, existing_dates, max_workers)
+
+def _init_pro():
+    """检查 TUSHARE_TOKEN 并初始化 Tushare（未设置时返回 None）"""
+    token = os.getenv('TUSHARE_TOKEN')
+    if not token:
+        print("错误: 请设置 TUSHARE_TOKEN 环境变量")
+        return None
+    ts.set_token(token)
+    return ts.pro_api()
+
+def sync_daily(max_workers=DEFAULT_WORKERS):
+    """同步日线数据（从库中最新日期的下一天同步到今天）"""
     print("=" * 50)
     print("同步日线数据")
     print("=" * 50)
 
     try:
-        # 初始化
         db_handler = get_db_handler()
-
-        # 检查TUSHARE_TOKEN
-        token = os.getenv('TUSHARE_TOKEN')
-        if not token:
-            print("错误: 请设置 TUSHARE_TOKEN 环境变量")
+        pro = _init_pro()
+        if pro is None:
             return False
 
-        # 初始化Tushare
-        ts.set_token(token)
-        pro = ts.pro_api()
-
         # 获取起始日期
         max_date = db_handler.get_max_date('daily')
         if max_date:
-            start_date = (pd.to_datetime(str(max_date)) + timedelta(days=1)).strftime('%Y%m%d')
+            start_date = (datetime.strptime(str(max_date), '%Y%m%d') + timedelta(days=1)).strftime('%Y%m%d')
             print(f"数据库最新日期: {max_date}, 从 {start_date} 开始同步")
         else:
             start_date = '20190101'
@@ -87,57 +309,12 @@ def sync_daily():
         end_date = datetime.now().strftime('%Y%m%d')
         print(f"同步到: {end_date}")
 
-        # 获取交易日
-        trade_dates = get_trade_dates(pro, start_date, end_date)
-        if not trade_dates:
+        result = _sync_range(pro, db_handler, start_date, end_date, max_workers)
+        if result is None:
             print("没有找到需要同步的交易日")
             return False
 
-        print(f"共需同步 {len(trade_dates)} 个交易日")
-
-        # 同步数据
-        total_records = 0
-        success_dates = []
-        # 预取已存在的 trade_date 列表，避免在循环中反复查询数据库
-        existing_dates = set()
-        try:
-            existing_query = f"SELECT trade_date FROM daily WHERE trade_date BETWEEN '{start_date}' AND '{end_date}'"
-            df_exist = pd.read_sql(existing_query, con=db_handler.get_engine())
-            if not df_exist.empty and 'trade_date' in df_exist.columns:
-                # 保持与 tushare 返回的一致格式（通常是字符串 YYYYMMDD）
-                existing_dates = set(df_exist['trade_date'].astype(str).tolist())
-                print(f"已预取 {len(existing_dates)} 条已存在的日期，循环中将跳过它们")
-        except Exception as e:
-            # 如果表不存在或查询失败，existing_dates 保持为空，之后 insert_data 会负责创建表
-            print(f"未能预取已存在的日期（表可能不存在），将逐个插入: {e}")
-
-        for trade_date in trade_dates:
-            try:
-                # 跳过已存在的日期（使用内存集合判断，快速）
-                if trade_date in existing_dates:
-                    print(f"{trade_date} 数据已存在，跳过")
-                    continue
-
-                # 获取数据
-                df = get_daily_data(pro, trade_date)
-                if df.empty:
-                    print(f"{trade_date} 数据为空，跳过")
-                    continue
-
-                # 插入数据库（insert_data 内部会负责创建表）
-                success = db_handler.insert_data('daily', df, trade_date)
-                if success:
-                    total_records += len(df)
-                    success_dates.append(trade_date)
-                    print(f"{trade_date} 同步完成，{len(df)} 条记录")
-
-                # 延迟避免请求过于频繁
-                time.sleep(0.5)
-
-            except Exception as e:
-                print(f"同步 {trade_date} 失败: {e}")
-                continue
-
+        total_records, success_dates = result
         print(f"日线数据同步完成，共 {len(success_dates)} 个交易日，{total_records} 条记录")
         return True
 
@@ -145,75 +322,24 @@ def sync_daily():
         print(f"同步失败: {e}")
         return False
 
-def sync_date_range(start_date, end_date):
+def sync_date_range(start_date, end_date, max_workers=DEFAULT_WORKERS):
     """同步指定日期范围"""
     print("=" * 50)
     print(f"同步日线数据 ({start_date} - {end_date})")
     print("=" * 50)
 
     try:
-        # 初始化
         db_handler = get_db_handler()
-
-        # 检查TUSHARE_TOKEN
-        token = os.getenv('TUSHARE_TOKEN')
-        if not token:
-            print("错误: 请设置 TUSHARE_TOKEN 环境变量")
+        pro = _init_pro()
+        if pro is None:
             return False
 
-        # 初始化Tushare
-        ts.set_token(token)
-        pro = ts.pro_api()
-
-        # 获取交易日
-        trade_dates = get_trade_dates(pro, start_date, end_date)
-        if not trade_dates:
+        result = _sync_range(pro, db_handler, start_date, end_date, max_workers)
+        if result is None:
             print("指定日期范围内没有交易日")
             return False
 
-        print(f"共需同步 {len(trade_dates)} 个交易日")
-
-        # 同步数据
-        total_records = 0
-        success_dates = []
-
-        # 预取已存在的 trade_date 列表，避免在循环中反复查询数据库
-        existing_dates = set()
-        try:
-            existing_query = f"SELECT trade_date FROM daily WHERE trade_date BETWEEN '{start_date}' AND '{end_date}'"
-            df_exist = pd.read_sql(existing_query, con=db_handler.get_engine())
-            if not df_exist.empty and 'trade_date' in df_exist.columns:
-                existing_dates = set(df_exist['trade_date'].astype(str).tolist())
-                print(f"已预取 {len(existing_dates)} 条已存在的日期，循环中将跳过它们")
-        except Exception as e:
-            print(f"未能预取已存在的日期（表可能不存在），将逐个插入: {e}")
-
-        for trade_date in trade_dates:
-            try:
-                # 跳过已存在的日期
-                if trade_date in existing_dates:
-                    print(f"{trade_date} 数据已存在，跳过")
-                    continue
-
-                # 获取数据
-                df = get_daily_data(pro, trade_date)
-                if df.empty:
-                    print(f"{trade_date} 数据为空，跳过")
-                    continue
-
-                # 插入数据库
-                success = db_handler.insert_data('daily', df, trade_date)
-                if success:
-                    total_records += len(df)
-                    success_dates.append(trade_date)
-                    print(f"{trade_date} 同步完成，{len(df)} 条记录")
-
-                time.sleep(0.5)
-
-            except Exception as e:
-                print(f"同步 {trade_date} 失败: {e}")
-                continue
-
+        total_records, success_dates = result
         print(f"指定日期范围同步完成，共 {len(success_dates)} 个交易日，{total_records} 条记录")
         return True
 
@@ -223,10 +349,16 @@ def sync_date_range(start_date, end_date):
 
 if __name__ == "__main__":
     try:
-        if len(sys.argv) > 1 and sys.argv[1] == "range" and len(sys.argv) == 4:
-            success = sync_date_range(sys.argv[2], sys.argv[3])
+        args = sys.argv[1:]
+        workers = DEFAULT_WORKERS
+        if len(args) >= 2 and args[-2] == "workers":
+            workers = int(args[-1])
+            args = args[:-2]
+
+        if len(args) == 3 and args[0] == "range":
+            success = sync_date_range(args[1], args[2], workers)
         else:
-            success = sync_daily()
+            success = sync_daily(workers)
 
         sys.exit(0 if success else 1)
     except KeyboardInterrupt:
@@ -4,26 +4,105 @@
 """
 
 import os
+import queue
 import sys
+import tempfile
+import threading
 import time
+import numpy as np
+import requests
 import tushare as ts
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime, timedelta
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from sqlalchemy import inspect, text
-import warnings
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from sqlalchemy import Column, Double, MetaData, String, Table, inspect, text
 from tqdm import tqdm
 
 # 添加当前目录到Python路径
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from db_handler import get_db_handler
-
-warnings.filterwarnings("ignore", category=FutureWarning, module=r"tushare\.pro\.data_pro")
+import tushare_warnings  # noqa: F401  导入即注册 tushare FutureWarning 过滤
 
 
 TARGET_TABLE = "daily_qfq_new"   # ************ ⬅⬅⬅ 现在写入 NEW 表 ************
 
+# 前复权数据的起始日期
+QFQ_START_DATE = '20190101'
+# 需要按复权因子调整的价格列（与 ts.pro_bar 一致）
+PRICE_COLS = ['open', 'high', 'low', 'close', 'pre_close']
+# 写库的数值列（与 pro.daily 返回列顺序一致）
+QFQ_FLOAT_COLS = ['open', 'high', 'low', 'close', 'pre_close', 'change', 'pct_chg', 'vol', 'amount']
+# flush 0 时 Parquet 暂存文件的列结构（与 build_qfq_table 一致）
+QFQ_ARROW_SCHEMA = pa.schema(
+    [('ts_code', pa.string()), ('trade_date', pa.string())]
+    + [(col, pa.float64()) for col in QFQ_FLOAT_COLS]
+)
+# 字符串列使用 Arrow 存储（数值列保持 float64，避免价格/成交额精度损失）
+QFQ_STRING_DTYPES = {'ts_code': pd.StringDtype('pyarrow'), 'trade_date': pd.StringDtype('pyarrow')}
+# 按交易日并发拉取的线程数（每个交易日 2 次接口调用）
+DEFAULT_WORKERS = 4
+
+# 结果先在内存中攒批，累计超过该行数再写库一次；0 表示先暂存到本地 Parquet，全部取完后再写库
+FLUSH_ROWS = 50000
+# 待写库队列长度上限（按交易日计）
+WRITE_QUEUE_SIZE = 64
+
+# 绑定参数，语句文本固定，可命中 SQLAlchemy 编译缓存
+LATEST_COUNT_SQL = text(
+    "SELECT COUNT(DISTINCT ts_code) as count FROM daily_qfq WHERE trade_date = :trade_date"
+)
+
+
+def build_qfq_table(table_name, metadata):
+    """前复权日线表结构（显式声明，建表与插入语句只解析一次，不再逐批由 to_sql 推断/反射）"""
+    return Table(
+        table_name,
+        metadata,
+        Column('ts_code', String(20)),
+        Column('trade_date', String(20)),
+        *(Column(col, Double) for col in QFQ_FLOAT_COLS),
+    )
+
+
+def bounded_as_completed(executor, fn, items, max_in_flight):
+    """按完成顺序产出 (item, future)，同时在途的任务不超过 max_in_flight
+
+    与一次性 submit 全部任务相比，已完成但尚未被消费的结果最多只有 max_in_flight 份，
+    写库变慢时拉取也随之暂停，内存占用与任务总数无关。
+    """
+    items = iter(items)
+    in_flight = {}
+
+    def submit_next():
+        for item in items:
+            in_flight[executor.submit(fn, item)] = item
+            return
+
+    for _ in range(max_in_flight):
+        submit_next()
+    while in_flight:
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield in_flight.pop(future), future
+            submit_next()
+
+
+def column_lists_to_records(df, columns):
+    """DataFrame -> executemany 参数列表；数值列的 NaN 转为 None（写入 NULL）"""
+    values = []
+    for col in columns:
+        items = df[col].tolist()
+        if col in QFQ_FLOAT_COLS:
+            items = [None if v != v else v for v in items]  # NaN != NaN
+        values.append(items)
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
 
 def get_latest_trade_date(pro):
     try:
@@ -45,9 +124,9 @@ def get_latest_trade_date(pro):
 
 def get_stock_codes(db_handler):
     try:
-        query = "SELECT ts_code FROM stock_basic"
-        result = pd.read_sql(query, con=db_handler.get_engine())
-        return result['ts_code'].tolist()
+        # 单列结果直接从游标取，不构造 DataFrame
+        with db_handler.get_engine().connect() as conn:
+            return conn.exec_driver_sql("SELECT ts_code FROM stock_basic").scalars().all()
     except:
         return []
 
@@ -66,15 +145,162 @@ def get_qfq_data(ts_code, start_date, max_retries=3):
     return pd.DataFrame()
 
 
-def need_sync_daily_qfq(db_handler, pro):
-    """保留原逻辑，但检查 old 表 daily_qfq"""
+@contextmanager
+def pooled_http_session(pool_size):
+    """在 with 块内让 tushare DataApi 复用带连接池的 requests.Session，退出时恢复原模块属性
+
+    tushare.pro.client 每次查询都调用模块级 requests.post，会新建 TCP/TLS 连接；
+    换成 Session 后各线程共享 keep-alive 连接，5xx/429 由 urllib3 在连接层退避重试。
+    接口层错误（返回 code != 0）仍由 call_with_retry 处理。
+    注意替换的是 tushare.pro.client 模块属性：with 块内同一进程里其他 tushare 调用也会走这个 Session。
+    """
+    try:
+        from tushare.pro import client as ts_client
+    except ImportError:
+        yield
+        return
+    if not hasattr(ts_client, 'requests'):
+        yield
+        return
+    retry = Retry(
+        total=3,
+        backoff_factor=2,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=None,  # tushare 查询均为 POST，且可安全重试
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size * 2, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    original = ts_client.requests
+    ts_client.requests = session
+    try:
+        yield
+    finally:
+        ts_client.requests = original
+        session.close()
+
+
+# 已初始化的 tushare 客户端；只缓存成功结果，未设置 token 时下次调用会重新读取环境变量
+_PRO = None
+
+
+def init_pro():
+    """读取 TUSHARE_TOKEN 并初始化 Tushare（进程内只做一次；未设置 token 时返回 None）"""
+    global _PRO
+    if _PRO is None:
+        token = os.getenv('TUSHARE_TOKEN')
+        if not token:
+            return None
+        ts.set_token(token)
+        _PRO = ts.pro_api()
+    return _PRO
+
+
+def call_with_retry(func, max_retries=3, **kwargs):
+    """调用 tushare 接口，失败时退避重试，最终失败抛出最后一次异常"""
+    for attempt in range(max_retries):
+        try:
+            return func(**kwargs)
+        except Exception:  # pylint: disable=broad-except
+            if attempt == max_retries - 1:
+                raise
+            time.sleep((attempt + 1) * 2)
+
+
+def get_open_dates(pro, start_date, end_date):
+    """区间内的开市日（升序）"""
+    trade_cal = call_with_retry(
+        pro.trade_cal, exchange='SSE', start_date=start_date, end_date=end_date,
+        fields='cal_date,is_open'
+    )
+    return sorted(trade_cal.loc[trade_cal['is_open'] == 1, 'cal_date'].astype(str).tolist())
+
+
+def get_latest_adj_factors(pro, trade_date, stock_codes):
+    """各股票截至 trade_date 最后一个可用的复权因子（前复权基准），仅保留 stock_basic 中的股票
+
+    当日停牌等没有因子的股票，单独取其历史因子中最新的一条补齐，
+    与 ts.pro_bar(adj='qfq') 按该股最后一个因子折算一致，不会整只股票被丢弃。
+    """
+    adj = call_with_retry(pro.adj_factor, trade_date=trade_date)
+    if adj is None or adj.empty:
+        return pd.Series(dtype='float64')
+    latest = adj.set_index('ts_code')['adj_factor'].dropna()
+    latest = latest[latest.index.isin(stock_codes)]
+
+    missing = [code for code in stock_codes if code not in latest.index]
+    if not missing:
+        return latest
+    print(f"{len(missing)} 只股票在 {trade_date} 无复权因子，改用各自最后一个可用因子")
+    filled = {}
+    for code in missing:
+        try:
+            history = call_with_retry(pro.adj_factor, ts_code=code, end_date=trade_date)
+        except Exception as e:  # pylint: disable=broad-except
+            print(f"获取 {code} 历史复权因子失败: {e}")
+            continue
+        if history is None or history.empty:
+            continue
+        factors = history.sort_values('trade_date')['adj_factor'].dropna()
+        if not factors.empty:
+            filled[code] = factors.iloc[-1]
+    unresolved = len(missing) - len(filled)
+    if unresolved:
+        print(f"{unresolved} 只股票没有任何可用复权因子，将不写入 {TARGET_TABLE}")
+    return pd.concat([latest, pd.Series(filled, dtype='float64')])
+
+
+def get_qfq_day(pro, trade_date, latest_adj):
+    """拉取某个交易日全市场日线 + 复权因子，本地向量化计算前复权价格
+
+    算法与 ts.pro_bar(adj='qfq') 相同：价格 × 当日复权因子 / 最新复权因子，保留两位小数，
+    再用复权后的 close/pre_close 重算 change、pct_chg。
+    """
+    daily = call_with_retry(pro.daily, trade_date=trade_date)
+    if daily is None or daily.empty:
+        return pd.DataFrame()
+    adj = call_with_retry(pro.adj_factor, trade_date=trade_date)
+    if adj is None or adj.empty:
+        return pd.DataFrame()
+
+    # 当日因子 / 最新因子，按 ts_code 对齐成与 daily 行序一致的 ndarray
+    codes = daily['ts_code']
+    day_adj = adj.set_index('ts_code')['adj_factor'].reindex(codes).to_numpy(dtype='float64')
+    base_adj = latest_adj.reindex(codes).to_numpy(dtype='float64')
+    ratio = day_adj / base_adj
+    keep = ~np.isnan(ratio)
+    daily = daily.loc[keep].copy()
+    ratio = ratio[keep]
+
+    # 全部价格列一次矩阵乘法 + 取整，不逐列走 pandas 对齐
+    prices = np.round(daily[PRICE_COLS].to_numpy(dtype='float64') * ratio[:, None], 2)
+    daily[PRICE_COLS] = prices
+    close, pre_close = prices[:, PRICE_COLS.index('close')], prices[:, PRICE_COLS.index('pre_close')]
+    change = np.round(close - pre_close, 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        daily['pct_chg'] = np.round(change / pre_close * 100, 2)
+    daily['change'] = change
+    # 代码/日期列改用 Arrow 字符串：攒批时内存更小，concat 只拼接缓冲区
+    return daily.astype(QFQ_STRING_DTYPES)
+
+
+def need_sync_daily_qfq(db_handler, pro, latest_trade_date=None, total_stocks=None):
+    """保留原逻辑，但检查 old 表 daily_qfq
+
+    调用方已取得最新交易日 / 股票总数时可直接传入，避免重复请求交易日历和重复查询 stock_basic。
+    """
     try:
-        latest_trade_date = get_latest_trade_date(pro)
-        total_stocks = len(get_stock_codes(db_handler))
+        if latest_trade_date is None:
+            latest_trade_date = get_latest_trade_date(pro)
+        if total_stocks is None:
+            total_stocks = len(get_stock_codes(db_handler))
 
-        query = f"SELECT COUNT(DISTINCT ts_code) as count FROM daily_qfq WHERE trade_date = '{latest_trade_date}'"
-        result = pd.read_sql(query, con=db_handler.get_engine())
-        latest_count = result.iloc[0]['count']
+        # 单个标量直接从游标取，不构造 DataFrame
+        with db_handler.get_engine().connect() as conn:
+            latest_count = conn.execute(
+                LATEST_COUNT_SQL, {"trade_date": latest_trade_date}
+            ).scalar() or 0
         ratio = latest_count / total_stocks if total_stocks else 0
 
         if ratio >= 0.9:
@@ -87,130 +313,231 @@ def need_sync_daily_qfq(db_handler, pro):
         return True
 
 
-def sync_daily_qfq(max_workers=16):
+def sync_daily_qfq(max_workers=DEFAULT_WORKERS, flush_rows=FLUSH_ROWS):
     print("=" * 50)
     print("同步前复权日线数据 → 写入 new 表，不删除旧表")
     print("=" * 50)
 
     try:
         db_handler = get_db_handler()
+        engine = db_handler.get_engine()
 
-        token = os.getenv('TUSHARE_TOKEN')
-        if not token:
+        pro = init_pro()
+        if pro is None:
             print("错误: 请设置 TUSHARE_TOKEN")
             return False
-
-        ts.set_token(token)
-        pro = ts.pro_api()
-
-        stock_codes = get_stock_codes(db_handler)
-        if not stock_codes:
-            print("无股票代码")
-            return False
-
-        print(f"共 {len(stock_codes)} 只股票")
-
-        end_date = get_latest_trade_date(pro)
-        print(f"同步到: {end_date}")
-
-        if not need_sync_daily_qfq(db_handler, pro):
-            print("数据已最新，不同步")
-            return True
-
-        # ************ 🚫 不删除 old 表 daily_qfq ************
-        # ************ ✔ 创建/覆盖 NEW 表 daily_qfq_new ************
-        print(f"准备写入新表: {TARGET_TABLE}")
-
-        # 确保 new 表是干净的
-        with db_handler.get_engine().connect() as conn:
-            print(f"清空或创建 {TARGET_TABLE} 表...")
-            conn.execute(text(f"DROP TABLE IF EXISTS {TARGET_TABLE}"))
-            conn.commit()
-
-        # 清理缓存
-        with db_handler._table_lock:
-            if TARGET_TABLE in db_handler._existing_tables:
-                db_handler._existing_tables.remove(TARGET_TABLE)
-
-        total_records = 0
-        success_count = 0
-
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_stock = {
-                executor.submit(get_qfq_data, ts_code, '20190101'): ts_code
-                for ts_code in stock_codes
-            }
-
-            print(f"已提交 {len(future_to_stock)} 个任务")
-
-            first_batch = True
-            processed = 0
-            failed_codes = []
-
-            with tqdm(total=len(future_to_stock), desc="同步进度", unit="stock") as pbar:
-                for future in as_completed(future_to_stock):
-                    ts_code = future_to_stock[future]
+        # 只在本次同步期间替换 tushare 的 HTTP 客户端，结束后恢复
+        with pooled_http_session(max_workers):
+
+            stock_codes = get_stock_codes(db_handler)
+            if not stock_codes:
+                print("无股票代码")
+                return False
+
+            print(f"共 {len(stock_codes)} 只股票")
+
+            end_date = get_latest_trade_date(pro)
+            print(f"同步到: {end_date}")
+
+            if not need_sync_daily_qfq(db_handler, pro, end_date, len(stock_codes)):
+                print("数据已最新，不同步")
+                return True
+
+            # ************ 🚫 不删除 old 表 daily_qfq ************
+            # ************ ✔ 创建/覆盖 NEW 表 daily_qfq_new ************
+            print(f"准备写入新表: {TARGET_TABLE}")
+
+            # 确保 new 表是干净的
+            with engine.connect() as conn:
+                print(f"清空或创建 {TARGET_TABLE} 表...")
+                conn.execute(text(f"DROP TABLE IF EXISTS {TARGET_TABLE}"))
+                conn.commit()
+
+            # 清理缓存
+            db_handler.invalidate_table_cache(TARGET_TABLE)
+
+            # 建表一次；之后每批复用同一个 Table 对象的 INSERT 语句
+            # 索引等全部数据写完后再一次性建立，避免每批插入都维护索引
+            qfq_table = build_qfq_table(TARGET_TABLE, MetaData())
+            qfq_table.create(engine)
+            insert_stmt = qfq_table.insert()
+
+            # 最新交易日的复权因子作为前复权基准；取不到则无法计算
+            latest_adj = get_latest_adj_factors(pro, end_date, stock_codes)
+            if latest_adj.empty:
+                print(f"未获取到 {end_date} 的复权因子，无法计算前复权价格")
+                return False
+
+            trade_dates = get_open_dates(pro, QFQ_START_DATE, end_date)
+            print(f"共 {len(trade_dates)} 个交易日，按交易日批量拉取")
+
+            total_records = 0
+            success_count = 0
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                # 在途任务数有上限，避免所有交易日结果同时驻留内存
+                completed = bounded_as_completed(
+                    executor,
+                    lambda trade_date: get_qfq_day(pro, trade_date, latest_adj),
+                    trade_dates,
+                    max_workers * 4,
+                )
+
+                processed = 0
+                failed_items = []
+                pending_frames = []
+                pending_dates = []
+                pending_rows = 0
+                # flush 0：各交易日数据先顺序写入本地 Parquet 暂存文件，全部取完后再分批读回写库，内存只占一批
+                spool_path = None
+                spool_writer = None
+                spooled_dates = []
+                # 拉取（主线程收集 future）与写库（写库线程）流水线并行；队列有界，写库慢时反压拉取
+                write_queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+                table_columns = [c.name for c in qfq_table.columns]
+
+                def insert_rows(batch):
+                    """一批数据按列取出 Python 列表后执行一次 executemany 写库"""
+                    nonlocal total_records
+                    # 逐列 tolist() 直接得到 Python 标量，不再构造 object DataFrame 再 to_dict
+                    with engine.begin() as conn:
+                        conn.execute(insert_stmt, column_lists_to_records(batch, table_columns))
+                    total_records += len(batch)
+
+                def flush_pending():
+                    """把攒下的多个交易日数据合并后一次写库"""
+                    nonlocal pending_rows, success_count
+                    if not pending_frames:
+                        return
+                    try:
+                        insert_rows(pd.concat(pending_frames, ignore_index=True))
+                        success_count += len(pending_dates)
+                    except Exception as e:  # pylint: disable=broad-except
+                        failed_items.extend(f"{trade_date}:写库失败 {e}" for trade_date in pending_dates)
+                    pending_frames.clear()
+                    pending_dates.clear()
+                    pending_rows = 0
+
+                def spool(trade_date, df):
+                    """把一个交易日的数据追加到 Parquet 暂存文件"""
+                    nonlocal spool_path, spool_writer
+                    if spool_writer is None:
+                        fd, path = tempfile.mkstemp(prefix=f"{TARGET_TABLE}_", suffix=".parquet")
+                        os.close(fd)
+                        try:
+                            spool_writer = pq.ParquetWriter(path, QFQ_ARROW_SCHEMA, compression='zstd')
+                        except Exception:
+                            # 建不出 writer 时删掉刚建的文件，下次调用重新 mkstemp 不会泄漏
+                            os.remove(path)
+                            raise
+                        spool_path = path
+                    spool_writer.write_table(
+                        pa.Table.from_pandas(df[table_columns], schema=QFQ_ARROW_SCHEMA, preserve_index=False)
+                    )
+                    spooled_dates.append(trade_date)
+
+                def load_spool():
+                    """关闭暂存文件，按 FLUSH_ROWS 分批读回写库，完成后删除文件"""
+                    nonlocal success_count
+                    if spool_writer is None:
+                        return
                     try:
-                        df = future.result()
-                        if not df.empty:
-                            if first_batch:
-                                df.to_sql(TARGET_TABLE, db_handler.get_engine(),
-                                          if_exists='replace', index=False)
-
-                                db_handler._create_indexes(TARGET_TABLE, df.columns.tolist())
-                                first_batch = False
-                            else:
-                                df.to_sql(TARGET_TABLE, db_handler.get_engine(),
-                                          if_exists='append', index=False)
-
-                            total_records += len(df)
-                            success_count += 1
-                        else:
-                            failed_codes.append(f"{ts_code}:无数据")
-
-                    except Exception as e:
-                        failed_codes.append(f"{ts_code}:{e}")
-
-                    processed += 1
-                    pbar.update(1)
-                    pbar.set_postfix({"成功数": success_count, "已处理": processed})
-
-        fail_count = len(failed_codes)
-        print("同步完成:")
-        print(f"  成功: {success_count}")
-        print(f"  失败/无数据: {fail_count}")
-        print(f"  总记录: {total_records}")
-        if failed_codes:
-            preview = failed_codes[:10]
-            print("  失败样本:")
-            for item in preview:
-                print(f"    {item}")
-            if fail_count > len(preview):
-                print(f"    ... 其余 {fail_count - len(preview)} 条")
+                        # close 时才落盘最后的数据并写 footer，磁盘满等错误也在这里抛出
+                        spool_writer.close()
+                        print(f"数据已全部取完，从暂存文件批量写入 {TARGET_TABLE} ...")
+                        for record_batch in pq.ParquetFile(spool_path).iter_batches(batch_size=FLUSH_ROWS):
+                            insert_rows(record_batch.to_pandas())
+                        success_count += len(spooled_dates)
+                    except Exception as e:  # pylint: disable=broad-except
+                        failed_items.extend(f"{trade_date}:写库失败 {e}" for trade_date in spooled_dates)
+                    finally:
+                        os.remove(spool_path)
+
+                def writer():
+                    """写库线程：从队列取数据攒批（或写入暂存文件），收到 None 时写出剩余数据并退出"""
+                    nonlocal pending_rows
+                    while True:
+                        item = write_queue.get()
+                        if item is None:
+                            flush_pending()
+                            load_spool()
+                            return
+                        trade_date, df = item
+                        if not flush_rows:
+                            try:
+                                spool(trade_date, df)
+                            except Exception as e:  # pylint: disable=broad-except
+                                failed_items.append(f"{trade_date}:暂存失败 {e}")
+                            continue
+                        pending_frames.append(df)
+                        pending_dates.append(trade_date)
+                        pending_rows += len(df)
+                        if pending_rows >= flush_rows:
+                            flush_pending()
+
+                writer_thread = threading.Thread(target=writer, name="daily_qfq_writer", daemon=True)
+                writer_thread.start()
+
+                try:
+                    with tqdm(total=len(trade_dates), desc="同步进度", unit="day") as pbar:
+                        for trade_date, future in completed:
+                            try:
+                                df = future.result()
+                                if not df.empty:
+                                    write_queue.put((trade_date, df))
+                                else:
+                                    failed_items.append(f"{trade_date}:无数据")
+
+                            except Exception as e:
+                                failed_items.append(f"{trade_date}:{e}")
+
+                            processed += 1
+                            pbar.update(1)
+                            pbar.set_postfix({"成功数": success_count, "已处理": processed})
+                finally:
+                    write_queue.put(None)
+                    writer_thread.join()
+
+            if total_records:
+                print(f"数据写入完成，为 {TARGET_TABLE} 建立索引...")
+                db_handler._create_indexes(TARGET_TABLE, [c.name for c in qfq_table.columns])  # noqa: SLF001
+
+            fail_count = len(failed_items)
+            print("同步完成:")
+            print(f"  成功交易日: {success_count}")
+            print(f"  失败/无数据: {fail_count}")
+            print(f"  总记录: {total_records}")
+            if failed_items:
+                preview = failed_items[:10]
+                print("  失败样本:")
+                for item in preview:
+                    print(f"    {item}")
+                if fail_count > len(preview):
+                    print(f"    ... 其余 {fail_count - len(preview)} 条")
+                # 有交易日缺失时 daily_qfq_new 不完整，返回失败，不能替换旧表
+                print(f"存在失败的交易日，{TARGET_TABLE} 不完整")
+                return False
 
-        return True
+            return True
 
     except Exception as e:
         print(f"同步失败: {e}")
         return False
 
 
-def sync_single_stock(ts_code):
+def sync_single_stock(ts_code, target_table=TARGET_TABLE):
     print("=" * 50)
-    print(f"同步单个股票 → 写入 {TARGET_TABLE}")
+    print(f"同步单个股票 → 写入 {target_table}")
     print("=" * 50)
 
     try:
         db_handler = get_db_handler()
-        token = os.getenv('TUSHARE_TOKEN')
-        if not token:
+        if init_pro() is None:
             print("请设置 TUSHARE_TOKEN")
             return False
 
-        ts.set_token(token)
-
-        max_date = db_handler.get_max_date(TARGET_TABLE)
-        start_date = (pd.to_datetime(str(max_date)) + timedelta(days=1)).strftime('%Y%m%d') if max_date else '20190101'
+        max_date = db_handler.get_max_date(target_table)
+        start_date = (datetime.strptime(str(max_date), '%Y%m%d') + timedelta(days=1)).strftime('%Y%m%d') if max_date else QFQ_START_DATE
 
         print(f"从 {start_date} 开始同步")
 
@@ -219,7 +546,7 @@ def sync_single_stock(ts_code):
             print("无新数据")
             return True
 
-        ok = db_handler.insert_data(TARGET_TABLE, df, ts_code)
+        ok = db_handler.insert_data(target_table, df, ts_code)
         print(f"{ts_code} 同步 {'成功' if ok else '失败'}")
         return ok
 
@@ -233,10 +560,13 @@ if __name__ == "__main__":
         if len(sys.argv) == 2 and sys.argv[1].startswith(
                 ('000', '001', '002', '300', '600', '601', '603', '605', '688', '689')):
             success = sync_single_stock(sys.argv[1])
-        elif len(sys.argv) == 3 and sys.argv[1] == "workers":
-            success = sync_daily_qfq(int(sys.argv[2]))
         else:
-            success = sync_daily_qfq()
+            # 可选参数: workers N / flush N（flush 0 = 先暂存 Parquet，全部取完后再写库）
+            options = dict(zip(sys.argv[1::2], sys.argv[2::2]))
+            success = sync_daily_qfq(
+                int(options.get("workers", DEFAULT_WORKERS)),
+                int(options.get("flush", FLUSH_ROWS)),
+            )
 
         sys.exit(0 if success else 1)
     except KeyboardInterrupt:
@@ -4,35 +4,76 @@
 支持自动创建表结构和索引
 """
 import os
+import re
+import csv
 import sys
+import queue
+import atexit
 import logging
+import logging.handlers
+import tempfile
 import threading
-from sqlalchemy import create_engine, text, inspect
+from sqlalchemy import create_engine, event, text, inspect, bindparam, String
 from sqlalchemy.engine import Engine
 import pandas as pd
-from datetime import datetime
 
-# 设置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    # LOAD DATA 的 TSV：无表头，NULL 写作 \N，只在需要时加引号
+    LOAD_DATA_CSV_OPTIONS = pacsv.WriteOptions(
+        include_header=False, delimiter='\t', null_string='\\N', quoting_style='needed',
+    )
+except (ImportError, TypeError):
+    # 未安装 pyarrow 或版本过旧：退回 csv 模块逐行写
+    pa = None
+
+# 设置日志：业务线程只把记录放进队列，文件/控制台写入由 QueueListener 后台线程完成
+_root_logger = logging.getLogger()
+if not _root_logger.handlers:
+    _log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    _log_handlers = [
         logging.FileHandler('db_handler.log', encoding='utf-8'),
-        logging.StreamHandler(sys.stdout)
+        logging.StreamHandler(sys.stdout),
     ]
-)
+    for _handler in _log_handlers:
+        _handler.setFormatter(_log_formatter)
+    _log_queue = queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(_log_queue, *_log_handlers)
+    _log_listener.start()
+    # 退出时把队列中剩余日志写完
+    atexit.register(_log_listener.stop)
+    _root_logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+    _root_logger.setLevel(logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 表名/列名会拼进 SQL 文本，只允许字母、数字与下划线
+VALID_TABLE_NAME = re.compile(r"^[A-Za-z0-9_]+$")
+
+
+def check_table_name(name: str) -> str:
+    """校验标识符，不合法时抛出 ValueError"""
+    if not isinstance(name, str) or not VALID_TABLE_NAME.fullmatch(name):
+        raise ValueError(f"非法表名: {name!r}，仅允许字母、数字与下划线")
+    return name
+
+
+# MySQL 预处理语句的占位符上限
+MAX_PLACEHOLDERS = 65535
+
 UPSERT_TABLE_CONFIG = {
     'daily': {
         'unique_key': 'uniq_ts_trade_date',
         'columns': [('ts_code', 20), ('trade_date', 20)],
         # default: INSERT IGNORE
+        # 纯数值/代码列，可安全用 LOAD DATA LOCAL INFILE 批量导入（不可用时自动回退临时表）
+        'bulk_load': True,
     },
     'daily_qfq': {
         'unique_key': 'uniq_ts_trade_date',
         'columns': [('ts_code', 20), ('trade_date', 20)],
         # default: INSERT IGNORE
+        'bulk_load': True,
     },
     'em_concept_daily': {
         'unique_key': 'uniq_concept_trade_date',
@@ -43,23 +84,237 @@ UPSERT_TABLE_CONFIG = {
         'unique_key': 'uniq_concept_code',
         'columns': [('concept_code', 40)],
         # 覆盖更新：同一个 concept_code 用最新数据替换
-        'strategy': 'replace',  # values: ignore | replace
+        'strategy': 'replace',  # values: ignore | replace | update
     },
     # em_concept_list 不需要临时表 UPSERT，整表重建
 }
 
+# 建表时显式声明的列类型：索引/唯一键列用 VARCHAR，不再由 to_sql 推断成 TEXT 而只能建前缀索引
+# 调用方传入的 dtype 优先；数值列仍交给 to_sql 推断
+COLUMN_TYPES = {
+    'stock_basic': {
+        'ts_code': String(20),
+        'symbol': String(16),
+        'area': String(50),
+        'industry': String(50),
+    },
+    'daily': {
+        'ts_code': String(20),
+        'trade_date': String(20),
+    },
+    'daily_qfq': {
+        'ts_code': String(20),
+        'trade_date': String(20),
+    },
+    'ths_hot_concept': {
+        'concept_code': String(40),
+    },
+}
+
+
+def definition_table_name(table_name: str, definitions: dict) -> str:
+    """`xxx_new` 没有单独定义时沿用 `xxx` 的定义"""
+    if table_name not in definitions and table_name.endswith('_new') and table_name[:-4] in definitions:
+        return table_name[:-4]
+    return table_name
+
+
+# 各表二级索引：(索引名后缀, [(列名, TEXT 列前缀长度，None 表示整列)])
+# 已在 COLUMN_TYPES / 建表代码中声明为 VARCHAR 的列不需要前缀长度
+# 主键在建表时处理，不在此列出
+INDEX_DEFINITIONS = {
+    'stock_basic': [
+        ('symbol', [('symbol', None)]),
+        ('industry', [('industry', None)]),
+        ('area', [('area', None)]),
+    ],
+    'daily': [
+        ('ts_code', [('ts_code', None)]),
+        ('trade_date', [('trade_date', None)]),
+        ('ts_code_trade_date', [('ts_code', None), ('trade_date', None)]),
+    ],
+    'daily_qfq': [
+        ('ts_code', [('ts_code', None)]),
+        ('trade_date', [('trade_date', None)]),
+        ('ts_code_trade_date', [('ts_code', None), ('trade_date', None)]),
+    ],
+    'daily_qfq_ak_sina': [
+        ('ts_code', [('ts_code', None)]),
+        ('trade_date', [('trade_date', None)]),
+        ('ts_code_trade_date', [('ts_code', None), ('trade_date', None)]),
+    ],
+    'daily_qfq_ak_tx': [
+        ('ts_code', [('ts_code', None)]),
+        ('trade_date', [('trade_date', None)]),
+        ('ts_code_trade_date', [('ts_code', None), ('trade_date', None)]),
+    ],
+    'em_concept_daily': [
+        ('concept_code', [('concept_code', 40)]),
+        ('trade_date', [('trade_date', 20)]),
+        ('concept_code_trade_date', [('concept_code', 40), ('trade_date', 20)]),
+    ],
+    'em_concept_list': [
+        ('concept_code', [('concept_code', 40)]),
+        ('concept_name', [('concept_name', 100)]),
+    ],
+    'stock_hot_rank': [
+        ('stock_code', [('stock_code', None)]),
+        ('record_date', [('record_date', None)]),
+        ('ranking', [('ranking', None)]),
+        ('stock_code_record_date', [('stock_code', None), ('record_date', None)]),
+    ],
+}
+
+
+def _make_index_builder(indexes: list):
+    """把一张表的索引定义预编译成构造函数：builder(表名) -> [(索引名, CREATE INDEX, ADD INDEX 子句)]
+
+    列清单（含前缀长度）在导入时拼好，调用时只把表名填进模板。
+    """
+    templates = []
+    for suffix, columns in indexes:
+        columns_sql = ", ".join(f"{col}({length})" if length else col for col, length in columns)
+        index_name = f"idx_{{table}}_{suffix}"
+        templates.append((
+            index_name,
+            f"CREATE INDEX {index_name} ON {{table}} ({columns_sql})",
+            f"ADD INDEX {index_name} ({columns_sql})",
+        ))
+
+    def build(table_name: str) -> list:
+        return [tuple(tpl.format(table=table_name) for tpl in entry) for entry in templates]
+
+    return build
+
+
+# 表名 -> 索引 DDL 构造函数，_create_indexes 直接按表名取用
+INDEX_BUILDERS = {table: _make_index_builder(indexes) for table, indexes in INDEX_DEFINITIONS.items()}
+
+# 当前库全部表名，一次查询即可填满已存在表缓存
+TABLE_LIST_SQL = text("SELECT table_name FROM information_schema.tables WHERE table_schema = DATABASE()")
+
+
+def _log_executemany_batch(conn, cursor, statement, parameters, context, executemany):
+    """before_cursor_execute 钩子：executemany 时输出本批行数"""
+    if executemany and logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"executemany 批量 {len(parameters)} 行: {statement[:80]}")
+
+
+# local_infile 未开启（客户端或服务端）时的错误码：1148 旧版本 / 2068 客户端拒绝 / 3948 MySQL 8
+LOAD_DATA_DISABLED_ERRORS = {1148, 2068, 3948}
+
+# LOAD DATA ... IGNORE 下重复键只产生这一类警告，其余警告（类型转换/截断等）视为错误
+DUPLICATE_KEY_WARNING = 1062
+
+
+def is_load_data_disabled(exc: Exception) -> bool:
+    """异常是否表示 LOAD DATA LOCAL INFILE 不可用（而非锁等待、断连等临时错误）"""
+    orig = getattr(exc, 'orig', None) or exc
+    args = getattr(orig, 'args', ())
+    return bool(args) and args[0] in LOAD_DATA_DISABLED_ERRORS
+
+
+def mysql_load_data_method(strategy: str = 'ignore', frame: pd.DataFrame = None):
+    """返回 to_sql 的 method 可调用对象：每个分块写成临时 TSV，经 LOAD DATA LOCAL INFILE 导入
+
+    strategy 为 ignore / replace，与临时表路径的 INSERT IGNORE / REPLACE INTO 语义一致；
+    按列名导入，不依赖表的列顺序。可调用对象返回导入的行数。
+    IGNORE 会把类型转换等错误降级为警告：导入后检查 SHOW WARNINGS，除重复键外的警告一律抛错，
+    与临时表路径 build_upsert_sql 的行为保持一致（只能看到服务端 max_error_count 条以内的警告）。
+    frame 为整表数据（调用方须以 chunksize=None 调用 to_sql）：给出且装有 pyarrow 时，
+    由 Arrow 按列向量化编码 TSV，不再逐格格式化 data_iter。
+    """
+    modifier = 'REPLACE' if strategy == 'replace' else 'IGNORE'
+
+    def load_data_insert(pd_table, conn, keys, data_iter):
+        preparer = conn.dialect.identifier_preparer
+        columns = ", ".join(preparer.quote(check_table_name(str(key))) for key in keys)
+        load_sql = (
+            f"LOAD DATA LOCAL INFILE %s {modifier} INTO TABLE {preparer.quote(pd_table.name)} "
+            "CHARACTER SET utf8mb4 FIELDS TERMINATED BY '\\t' OPTIONALLY ENCLOSED BY '\"' "
+            "LINES TERMINATED BY '\\n' "
+            f"({columns})"
+        )
+
+        fd, path = tempfile.mkstemp(prefix=f"load_{pd_table.name}_", suffix=".tsv")
+        try:
+            if frame is not None and pa is not None:
+                os.close(fd)
+                arrow_table = pa.Table.from_pandas(frame[list(keys)], preserve_index=False)
+                pacsv.write_csv(arrow_table, path, write_options=LOAD_DATA_CSV_OPTIONS)
+            else:
+                with os.fdopen(fd, 'w', encoding='utf-8', newline='') as fh:
+                    writer = csv.writer(fh, delimiter='\t', quotechar='"', lineterminator='\n')
+                    writer.writerows(
+                        ['\\N' if value is None else value for value in row] for row in data_iter
+                    )
+            # 与 to_sql 同一连接、同一事务，由 pandas 统一提交
+            cursor = conn.connection.cursor()
+            try:
+                cursor.execute(load_sql, (path,))
+                rowcount = cursor.rowcount
+                cursor.execute("SHOW WARNINGS")
+                problems = [row for row in cursor.fetchall() if row[1] != DUPLICATE_KEY_WARNING]
+                if problems:
+                    level, code, message = problems[0][:3]
+                    raise ValueError(
+                        f"LOAD DATA 导入 {pd_table.name} 产生 {len(problems)} 条警告，"
+                        f"首条: {level} {code} {message}"
+                    )
+                return rowcount
+            finally:
+                cursor.close()
+        finally:
+            os.remove(path)
+
+    return load_data_insert
+
+
+# ignore: 已存在的键保持不变；replace: 删除旧行后写入新行；update: 已存在的键就地更新非键列
+UPSERT_STRATEGIES = ('ignore', 'replace', 'update')
+
+
+def build_upsert_sql(table_name: str, staging_table: str, columns: list, strategy: str,
+                     key_columns: list) -> str:
+    """从中转表合并到目标表的 SQL
+
+    ignore 用 ON DUPLICATE KEY UPDATE 键列=键列 代替 INSERT IGNORE：重复键同样跳过，
+    但类型转换等真实错误不会被吞成警告。
+    """
+    column_list = ", ".join(columns)
+    select_sql = f"SELECT {column_list} FROM {staging_table} AS src"
+    if strategy == 'replace':
+        return f"REPLACE INTO {table_name} ({column_list}) {select_sql}"
+    if strategy == 'update':
+        assignments = ", ".join(f"{col} = src.{col}" for col in columns if col not in key_columns)
+    else:
+        assignments = None
+    if not assignments:
+        key = key_columns[0]
+        assignments = f"{key} = {table_name}.{key}"
+    return f"INSERT INTO {table_name} ({column_list}) {select_sql} ON DUPLICATE KEY UPDATE {assignments}"
+
+
 class DatabaseHandler:
     """数据库处理器"""
 
     def __init__(self, host: str = None, port: int = None, user: str = None,
-                 password: str = None, database: str = None):
-        """初始化数据库连接"""
+                 password: str = None, database: str = None, insert_chunksize: int = 2000,
+                 pool_size: int = 16, max_overflow: int = 16):
+        """初始化数据库连接
+
+        insert_chunksize: to_sql 多行 INSERT 每条语句的行数（会按列数再收紧，不超过占位符上限）
+        pool_size / max_overflow: 连接池常驻与溢出连接数，多线程并发同步时避免排队等连接
+        """
         self.host = host or 'localhost'
         self.port = port or 3306
         # 使用root用户连接数据库
         self.user = os.getenv('MYSQL_USER') or user or 'root'
         self.password = password or os.getenv('MYSQL_ROOT_PASSWORD') or os.getenv('MYSQL_PASSWORD') or ''
         self.database = database or 'tushare_sync'
+        self.insert_chunksize = insert_chunksize
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
 
         self.engine = None
         self._inspector = None
@@ -67,6 +322,16 @@ class DatabaseHandler:
         self._existing_tables = set()
         # Lock to protect _existing_tables and inspector updates (thread-safe)
         self._table_lock = threading.RLock()
+        # insert_data 已确认存在的表，热路径上无锁查找
+        self._ensured_tables = set()
+        # 本进程内已确认存在唯一约束的 UPSERT 表
+        self._unique_key_ensured = set()
+        # (语句类别, 表名, ...) -> text() 语句对象，同一语句只构造一次
+        self._stmt_cache = {}
+        # 表名 -> 已存在索引名集合，避免每建一个索引就 SHOW INDEX 一次
+        self._index_cache = {}
+        # 确认 local_infile 未开启后置为 False，本进程内回退到临时表写入
+        self._load_data_enabled = True
 
         self._connect()
 
@@ -74,20 +339,25 @@ class DatabaseHandler:
         """建立数据库连接"""
         try:
             connection_string = f"mysql+pymysql://{self.user}:{self.password}@{self.host}:{self.port}/{self.database}?charset=utf8mb4"
-            self.engine = create_engine(connection_string, pool_pre_ping=True, pool_recycle=3600)
+            # local_infile: 允许 LOAD DATA LOCAL INFILE 批量导入（服务端也需开启 local_infile）
+            self.engine = create_engine(
+                connection_string, pool_size=self.pool_size, max_overflow=self.max_overflow,
+                pool_pre_ping=True, pool_recycle=1800,
+                connect_args={'local_infile': True},
+            )
+            # DEBUG 级别下记录 executemany 的批大小，便于调整 insert_chunksize
+            event.listen(self.engine, 'before_cursor_execute', _log_executemany_batch)
 
             # 测试连接
             with self.engine.connect() as conn:
                 conn.execute(text("SELECT 1"))
 
             logger.info(f"数据库连接成功: {self.host}:{self.port}/{self.database}")
-            # Cache inspector and current table list to reduce repeated introspection
+            # 进程内只创建一个 Inspector，并预取现有表名，之后按建表/删表事件维护缓存
             try:
-                self._inspector = inspect(self.engine)
-                self._existing_tables = set(self._inspector.get_table_names())
+                self._refresh_table_list()
             except Exception:
-                # If inspector creation fails, leave cache empty; methods will fall back to fresh inspectors
-                self._inspector = None
+                # 预取失败时缓存留空，后续未命中时再刷新
                 self._existing_tables = set()
 
         except Exception as e:
@@ -111,248 +381,189 @@ class DatabaseHandler:
             logger.error(f"创建数据库失败: {e}")
             raise
 
-    def ensure_table_exists(self, table_name: str, df: pd.DataFrame):
+    def ensure_table_exists(self, table_name: str, df: pd.DataFrame, dtype: dict = None):
         """确保表存在，如果不存在则创建（包括索引）"""
         try:
-            # First check local cache to avoid DB round-trip
-            with self._table_lock:
-                if table_name in self._existing_tables:
-                    # 缓存命中不必要频繁输出到 INFO，改为 DEBUG 以减少噪音
-                    logger.debug(f"表 {table_name} 已存在 (缓存)")
-                    return
-
-            # Fallback to inspector check if cache doesn't contain the table
-            inspector = self._inspector or inspect(self.engine)
-            if not inspector.has_table(table_name):
+            # 先查已存在表缓存，未命中再用共享 Inspector 检查
+            if not self._table_exists(table_name):
                 logger.info(f"创建表: {table_name}")
 
-                # 创建表
-                df.to_sql(table_name, self.engine, if_exists='replace', index=False)
+                # 创建表：预置列类型与调用方 dtype 合并，调用方优先
+                column_types = COLUMN_TYPES.get(definition_table_name(table_name, COLUMN_TYPES), {})
+                df.to_sql(table_name, self.engine, if_exists='replace', index=False,
+                          dtype={**column_types, **(dtype or {})}, **self.to_sql_kwargs(df))
+                # 建表事件：清掉该表的旧反射结果（has_table=False 等）
+                self.invalidate_table_cache(table_name)
 
-                # 创建索引
+                # 新表没有任何索引，直接写入空快照，省去一次反射
+                with self._table_lock:
+                    self._index_cache[table_name] = set()
+
+                # 创建索引；UPSERT 表建表时一并建立唯一约束，插入路径不再反复 ALTER TABLE
                 self._create_indexes(table_name, df.columns.tolist())
+                self._ensure_unique_key(table_name)
 
-                # 更新缓存
-                try:
-                    with self._table_lock:
-                        if self._inspector:
-                            # refresh inspector internal state
-                            self._existing_tables.add(table_name)
-                        else:
-                            # create and cache a fresh inspector
-                            self._inspector = inspect(self.engine)
-                            self._existing_tables = set(self._inspector.get_table_names())
-                except Exception:
-                    # ignore caching failure
-                    pass
+                self._mark_table(table_name)
             else:
-                logger.info(f"表 {table_name} 已存在")
-                # Update cache to avoid future checks
-                try:
-                    with self._table_lock:
-                        self._existing_tables.add(table_name)
-                except Exception:
-                    pass
+                # 缓存命中不必要频繁输出到 INFO，改为 DEBUG 以减少噪音
+                logger.debug(f"表 {table_name} 已存在")
 
         except Exception as e:
             logger.error(f"确保表存在失败: {e}")
             raise
 
     def _create_indexes(self, table_name: str, columns: list):
-        """为表创建索引"""
-        index_definitions = {
-            'stock_basic': [
-                ('ts_code', 'PRIMARY KEY'),
-                ('symbol', 'INDEX'),
-                ('industry', 'INDEX'),
-                ('area', 'INDEX'),
-            ],
-            'daily': [
-                ('ts_code', 'INDEX'),
-                ('trade_date', 'INDEX'),
-                ('ts_code_trade_date', 'INDEX (ts_code, trade_date)'),
-            ],
-            'daily_qfq': [
-                ('ts_code', 'INDEX'),
-                ('trade_date', 'INDEX'),
-                ('ts_code_trade_date', 'INDEX (ts_code, trade_date)'),
-            ],
-            'daily_qfq_ak_sina': [
-                ('ts_code', 'INDEX'),
-                ('trade_date', 'INDEX'),
-                ('ts_code_trade_date', 'INDEX (ts_code, trade_date)'),
-            ],
-            'daily_qfq_ak_tx': [
-                ('ts_code', 'INDEX'),
-                ('trade_date', 'INDEX'),
-                ('ts_code_trade_date', 'INDEX (ts_code, trade_date)'),
-            ],
-            'em_concept_daily': [
-                ('concept_code', 'INDEX'),
-                ('trade_date', 'INDEX'),
-                ('concept_code_trade_date', 'INDEX (concept_code, trade_date)'),
-            ],
-            'em_concept_list': [
-                ('concept_code', 'INDEX'),
-                ('concept_name', 'INDEX'),
-            ],
-            'em_concept_daily': [
-                ('concept_code', 'INDEX'),
-                ('trade_date', 'INDEX'),
-                ('concept_code_trade_date', 'INDEX (concept_code, trade_date)'),
-            ],
-            'stock_hot_rank': [
-                ('stock_code', 'INDEX'),
-                ('record_date', 'INDEX'),
-                ('ranking', 'INDEX'),
-                ('stock_code_record_date', 'INDEX (stock_code, record_date)'),
-            ]
-        }
-
-        definition_table = table_name
-        if definition_table not in index_definitions and definition_table.endswith('_new'):
-            candidate = definition_table[:-4]
-            if candidate in index_definitions:
-                definition_table = candidate
-
-        if definition_table in index_definitions:
-            for index_def in index_definitions[definition_table]:
-                index_name = index_def[0]
-                index_type = index_def[1]
+        """为表创建索引（各表 DDL 构造函数在模块加载时生成，这里只取用并执行）"""
+        build_indexes = INDEX_BUILDERS.get(definition_table_name(table_name, INDEX_BUILDERS))
 
+        if build_indexes is not None:
+            # 索引快照每张表只反射一次，后续调用直接复用缓存
+            with self._table_lock:
+                existing_indexes = self._index_cache.get(table_name)
+            if existing_indexes is None:
+                existing_indexes = {idx['name'] for idx in self.get_inspector().get_indexes(table_name)}
+                with self._table_lock:
+                    self._index_cache[table_name] = existing_indexes
+
+            missing = []
+            for index_name_full, index_sql, add_clause in build_indexes(table_name):
+                if index_name_full in existing_indexes:
+                    logger.debug(f"索引已存在: {index_name_full}")
+                else:
+                    missing.append((index_name_full, index_sql, add_clause))
+
+            # MySQL 一条 ALTER TABLE 带多个 ADD INDEX，只重建一次表
+            if len(missing) > 1 and self.engine.dialect.name in ('mysql', 'mariadb'):
+                add_clauses = ", ".join(add_clause for _, _, add_clause in missing)
                 try:
-                    if index_type == 'PRIMARY KEY':
-                        # 主键已经在创建表时处理
-                        continue
-                    elif index_type.startswith('INDEX'):
-                        # 检查索引是否已存在
-                        inspector = inspect(self.engine)
-                        existing_indexes = [idx['name'] for idx in inspector.get_indexes(table_name)]
-                        index_name_full = f"idx_{table_name}_{index_name}"
-
-                        if index_name_full not in existing_indexes:
-                            if '(' in index_type:
-                                # 复合索引
-                                if definition_table in ['daily', 'daily_qfq'] and 'ts_code' in index_type:
-                                    # TEXT字段需要指定索引长度
-                                    index_sql = f"CREATE INDEX {index_name_full} ON {table_name} (ts_code(20), trade_date(20))"
-                                elif definition_table in ['em_concept_daily', 'em_concept_daily'] and 'concept_code' in index_type:
-                                    index_sql = f"CREATE INDEX {index_name_full} ON {table_name} (concept_code(40), trade_date(20))"
-                                else:
-                                    columns_part = index_type.split('(', 1)[1]
-                                    if not columns_part.startswith('('):
-                                        columns_part = f"({columns_part}"
-                                    index_sql = f"CREATE INDEX {index_name_full} ON {table_name} {columns_part}"
-                            else:
-                                # 单列索引
-                                if table_name == 'stock_basic' and index_name in ['symbol', 'industry', 'area']:
-                                    # TEXT字段需要指定索引长度
-                                    index_sql = f"CREATE INDEX {index_name_full} ON {table_name} ({index_name}(50))"
-                                elif definition_table in ['daily', 'daily_qfq'] and index_name in ['ts_code', 'trade_date']:
-                                    # TEXT字段需要指定索引长度
-                                    index_sql = f"CREATE INDEX {index_name_full} ON {table_name} ({index_name}(20))"
-                                elif definition_table == 'em_concept_list' and index_name == 'concept_code':
-                                    index_sql = f"CREATE INDEX {index_name_full} ON {table_name} ({index_name}(40))"
-                                elif definition_table == 'em_concept_list' and index_name == 'concept_name':
-                                    index_sql = f"CREATE INDEX {index_name_full} ON {table_name} ({index_name}(100))"
-                                elif definition_table == 'em_concept_daily' and index_name == 'concept_code':
-                                    index_sql = f"CREATE INDEX {index_name_full} ON {table_name} ({index_name}(40))"
-                                elif definition_table == 'em_concept_daily' and index_name == 'trade_date':
-                                    index_sql = f"CREATE INDEX {index_name_full} ON {table_name} ({index_name}(20))"
-                                elif definition_table == 'em_concept_daily' and index_name == 'concept_code':
-                                    index_sql = f"CREATE INDEX {index_name_full} ON {table_name} ({index_name}(40))"
-                                elif definition_table == 'em_concept_daily' and index_name == 'trade_date':
-                                    index_sql = f"CREATE INDEX {index_name_full} ON {table_name} ({index_name}(20))"
-                                else:
-                                    index_sql = f"CREATE INDEX {index_name_full} ON {table_name} ({index_name})"
-
-                            try:
-                                with self.engine.connect() as conn:
-                                    conn.execute(text(index_sql))
-                                    conn.commit()
-                                logger.info(f"创建索引: {index_name_full}")
-                            except Exception as e:
-                                logger.warning(f"创建索引失败 {index_name_full}: {e}")
-                        else:
-                            logger.info(f"索引已存在: {index_name_full}")
+                    with self.engine.begin() as conn:
+                        conn.execute(text(f"ALTER TABLE {table_name} {add_clauses}"))
+                    with self._table_lock:
+                        existing_indexes.update(name for name, _, _ in missing)
+                    logger.debug(f"创建索引: {', '.join(name for name, _, _ in missing)}")
+                    missing = []
+                except Exception as e:
+                    logger.warning(f"批量创建索引失败，改为逐个创建: {e}")
 
+            for index_name_full, index_sql, _ in missing:
+                try:
+                    with self.engine.connect() as conn:
+                        conn.execute(text(index_sql))
+                        conn.commit()
+                    with self._table_lock:
+                        existing_indexes.add(index_name_full)
+                    logger.debug(f"创建索引: {index_name_full}")
                 except Exception as e:
-                    logger.warning(f"处理索引 {index_name} 时发生错误: {e}")
+                    logger.warning(f"创建索引失败 {index_name_full}: {e}")
+
+    def _ensure_unique_key(self, table_name: str):
+        """为 UPSERT 表添加唯一约束；本进程内已确认过的表直接跳过，不再每次 ALTER TABLE"""
+        table_config = UPSERT_TABLE_CONFIG.get(table_name)
+        if not table_config:
+            return
+        with self._table_lock:
+            if table_name in self._unique_key_ensured:
+                return
+
+        with self.engine.connect() as conn:
+            try:
+                unique_columns = ", ".join(
+                    f"{col}({length})" if length else col
+                    for col, length in table_config['columns']
+                )
+                conn.execute(text(f"""
+                    ALTER TABLE {table_name}
+                    ADD UNIQUE KEY {table_config['unique_key']} ({unique_columns})
+                """))
+                conn.commit()
+                logger.info(f"添加唯一约束到表 {table_name}")
+            except Exception as e:
+                # 约束可能已存在，忽略错误
+                logger.debug(f"添加唯一约束失败（可能已存在）: {e}")
+
+        with self._table_lock:
+            self._unique_key_ensured.add(table_name)
+
+    def insert_data(self, table_name: str, data: pd.DataFrame, record_id: str = None,
+                    dtype: dict = None):
+        """插入数据到数据库，自动避免重复
 
-    def insert_data(self, table_name: str, data: pd.DataFrame, record_id: str = None):
-        """插入数据到数据库，自动避免重复"""
+        dtype 为可选的 {列名: SQLAlchemy 类型}，直接交给 to_sql，省去逐列类型推断。
+        """
         try:
+            check_table_name(table_name)
             if data.empty:
                 logger.warning(f"数据为空，跳过插入: {table_name}")
                 return False
 
-            # 确保表存在：如果缓存命中则跳过额外检查以减少重复开销
-            with self._table_lock:
-                table_known = table_name in self._existing_tables
-
-            if not table_known:
-                self.ensure_table_exists(table_name, data)
+            # 确保表存在：本进程已确认过的表只做一次无锁集合查找（单次 in 在 GIL 下是原子的）
+            if table_name not in self._ensured_tables:
+                self.ensure_table_exists(table_name, data, dtype)
+                self._ensured_tables.add(table_name)
 
             # 插入数据，避免重复
             rows_inserted = len(data)
 
-            # 对于daily_qfq和daily表，使用INSERT IGNORE避免重复数据
+            # UPSERT 表（daily、daily_qfq 等）依靠唯一约束去重
             if table_name in UPSERT_TABLE_CONFIG:
                 table_config = UPSERT_TABLE_CONFIG[table_name]
                 strategy = (table_config.get('strategy') or 'ignore').lower()
-                if strategy not in ('ignore', 'replace'):
+                if strategy not in UPSERT_STRATEGIES:
                     logger.warning(f"未知的 UPSERT strategy={strategy}，回退为 ignore: {table_name}")
                     strategy = 'ignore'
-                # 先创建临时表
-                temp_table = f"temp_{table_name}_{int(datetime.now().timestamp())}"
-                data.to_sql(temp_table, self.engine, if_exists='replace', index=False)
+                # 确保有唯一约束（INSERT IGNORE / REPLACE / LOAD DATA 都依赖它去重）；每个进程每张表只检查一次
+                self._ensure_unique_key(table_name)
 
-                # 使用INSERT IGNORE插入数据，利用唯一约束避免重复
-                with self.engine.connect() as conn:
-                    # 确保有唯一约束
+                rows_affected = None
+                # LOAD DATA 只支持 IGNORE / REPLACE，update 策略走中转表
+                if table_config.get('bulk_load') and self._load_data_enabled and strategy != 'update':
                     try:
-                        unique_columns = ", ".join(
-                            f"{col}({length})" if length else col
-                            for col, length in table_config['columns']
+                        # 整表一个分块：一次 LOAD DATA 导入全部行
+                        rows_affected = data.to_sql(
+                            table_name, self.engine, if_exists='append', index=False,
+                            method=mysql_load_data_method(strategy, frame=data), chunksize=None,
                         )
-                        conn.execute(text(f"""
-                            ALTER TABLE {table_name}
-                            ADD UNIQUE KEY {table_config['unique_key']} ({unique_columns})
-                        """))
-                        conn.commit()
-                        logger.info(f"添加唯一约束到表 {table_name}")
                     except Exception as e:
-                        # 约束可能已存在，忽略错误
-                        logger.debug(f"添加唯一约束失败（可能已存在）: {e}")
-
-                    # 写入策略
-                    if strategy == 'replace':
-                        insert_sql = f"""
-                            REPLACE INTO {table_name}
-                            SELECT * FROM {temp_table}
-                        """
-                    else:
-                        insert_sql = f"""
-                            INSERT IGNORE INTO {table_name}
-                            SELECT * FROM {temp_table}
-                        """
-                    result = conn.execute(text(insert_sql))
-                    conn.commit()
-                    rows_affected = result.rowcount
-
-                    # 删除临时表
-                    conn.execute(text(f"DROP TABLE {temp_table}"))
-                    conn.commit()
-
-                    logger.info(f"成功插入 {rows_affected} 行数据到 {table_name}（跳过重复数据）")
+                        if is_load_data_disabled(e):
+                            # 服务端/客户端未开启 local_infile：本进程内不再尝试
+                            self._load_data_enabled = False
+                            logger.warning(f"LOAD DATA LOCAL INFILE 不可用，改用临时表写入: {e}")
+                        else:
+                            # 锁等待超时、断连、数据警告等：仅本批回退临时表，之后仍走 LOAD DATA
+                            logger.warning(f"LOAD DATA 导入失败，本批改用临时表写入: {e}")
+
+                if rows_affected is None:
+                    # 会话级临时表：只对当前连接可见，多线程/多进程同时写同一张表互不干扰
+                    staging_table = f"staging_{table_name}"
+                    columns = tuple(data.columns)
+                    insert_stmt = self._cached_text(
+                        ('upsert', table_name, strategy, columns),
+                        lambda: build_upsert_sql(
+                            table_name, staging_table, list(columns), strategy,
+                            [col for col, _ in table_config['columns']],
+                        ),
+                    )
+                    with self.engine.connect() as conn:
+                        self._create_staging_table(conn, table_name, staging_table, columns)
+                        try:
+                            data.to_sql(staging_table, conn, if_exists='append', index=False,
+                                        **self.to_sql_kwargs(data))
+                            # 按写入策略从临时表合并，利用唯一约束避免重复
+                            rows_affected = conn.execute(insert_stmt).rowcount
+                            conn.commit()
+                        finally:
+                            conn.execute(self._drop_staging_stmt(staging_table))
+
+                logger.info(f"成功插入 {rows_affected} 行数据到 {table_name}（跳过重复数据）")
             else:
                 # 其他表使用原有逻辑
-                data.to_sql(table_name, self.engine, if_exists='append', index=False)
+                data.to_sql(table_name, self.engine, if_exists='append', index=False, dtype=dtype,
+                            **self.to_sql_kwargs(data))
                 rows_affected = rows_inserted
                 logger.info(f"成功插入 {rows_inserted} 行数据到 {table_name}")
 
             if record_id:
-                logger.info(f"记录ID: {record_id}")
+                logger.debug(f"记录ID: {record_id}")
 
             return True
 
@@ -360,20 +571,50 @@ class DatabaseHandler:
             logger.error(f"插入数据失败 {table_name}: {e}")
             return False
 
+    def _create_staging_table(self, conn, table_name: str, staging_table: str, columns: tuple):
+        """在 conn 上按本批列从目标表新建临时表（不带索引/唯一键）
+
+        每次都先删后建：连接池复用的连接上可能残留上次失败留下的临时表，
+        且按目标表当前结构建表，目标表改过列后不会沿用旧结构。
+        """
+        conn.execute(self._drop_staging_stmt(staging_table))
+        conn.execute(self._cached_text(
+            ('staging', table_name, columns),
+            lambda: (f"CREATE TEMPORARY TABLE {staging_table} AS "
+                     f"SELECT {', '.join(columns)} FROM {table_name} WHERE 1 = 0"),
+        ))
+
+    def _drop_staging_stmt(self, staging_table: str):
+        """DROP TEMPORARY TABLE 语句：只删本连接的临时表，不触及同名普通表，也不隐式提交"""
+        return self._cached_text(
+            ('drop_staging', staging_table),
+            lambda: f"DROP TEMPORARY TABLE IF EXISTS {staging_table}",
+        )
+
+    def _cached_text(self, key: tuple, build_sql):
+        """按 key 缓存 text() 语句对象；标识符无法绑定为参数，按表/列名各缓存一份"""
+        with self._table_lock:
+            stmt = self._stmt_cache.get(key)
+            if stmt is None:
+                stmt = self._stmt_cache[key] = text(build_sql())
+            return stmt
+
+    def _truncate_stmt(self, table_name: str):
+        """TRUNCATE TABLE 语句（已校验的表名）"""
+        return self._cached_text(
+            ('truncate', table_name),
+            lambda: f"TRUNCATE TABLE {self.engine.dialect.identifier_preparer.quote(table_name)}",
+        )
+
     def empty_table(self, table_name: str):
         """清空表"""
         try:
-            # Use cached table list if available
-            if table_name not in self._existing_tables:
-                # fallback to inspector check
-                inspector = self._inspector or inspect(self.engine)
-                exists = inspector.has_table(table_name)
-            else:
-                exists = True
+            check_table_name(table_name)
+            exists = self._table_exists(table_name)
 
             if exists:
                 with self.engine.connect() as conn:
-                    conn.execute(text(f"TRUNCATE TABLE {table_name}"))
+                    conn.execute(self._truncate_stmt(table_name))
                     conn.commit()
                 logger.info(f"表 {table_name} 已清空")
             else:
@@ -386,20 +627,21 @@ class DatabaseHandler:
     def get_max_date(self, table_name: str, date_column: str = 'trade_date'):
         """获取表中的最大日期"""
         try:
-            # 如果缓存中没有该表名，先做一次检查以避免后续重复检查
-            if table_name not in self._existing_tables:
-                inspector = self._inspector or inspect(self.engine)
-                if not inspector.has_table(table_name):
-                    return None
-                # update cache
-                try:
-                    self._existing_tables.add(table_name)
-                except Exception:
-                    pass
-
-            query = f"SELECT MAX({date_column}) as max_date FROM {table_name}"
-            result = pd.read_sql(query, self.engine)
-            max_date = result.iloc[0, 0]
+            check_table_name(table_name)
+            check_table_name(date_column)
+            if not self._table_exists(table_name):
+                return None
+
+            preparer = self.engine.dialect.identifier_preparer
+            quoted_column = preparer.quote(date_column)
+            # ORDER BY ... DESC LIMIT 1 可沿日期索引只读一行，MAX 在 TEXT 列上会退化为全表扫描
+            query = self._cached_text(
+                ('max_date', table_name, date_column),
+                lambda: (f"SELECT {quoted_column} AS max_date FROM {preparer.quote(table_name)} "
+                         f"ORDER BY {quoted_column} DESC LIMIT 1"),
+            )
+            with self.engine.connect() as conn:
+                max_date = conn.execute(query).scalar()
             return max_date
         except Exception as e:
             logger.error(f"获取最大日期失败: {e}")
@@ -409,6 +651,89 @@ class DatabaseHandler:
         """获取数据库引擎"""
         return self.engine
 
+    def get_inspector(self):
+        """获取进程内复用的 Inspector（共享其 info_cache，避免重复反射查询）"""
+        with self._table_lock:
+            if self._inspector is None:
+                self._inspector = inspect(self.engine)
+            return self._inspector
+
+    def _mark_table(self, *table_names):
+        """记录已确认存在的表（建表或检查命中后调用）"""
+        with self._table_lock:
+            self._existing_tables.update(table_names)
+
+    def _refresh_table_list(self):
+        """一次查询取回当前库的全部表名并并入缓存（MySQL 走 information_schema）"""
+        if self.engine.dialect.name in ('mysql', 'mariadb'):
+            with self.engine.connect() as conn:
+                names = conn.execute(TABLE_LIST_SQL).scalars().all()
+        else:
+            inspector = self.get_inspector()
+            inspector.clear_cache()
+            names = inspector.get_table_names()
+        self._mark_table(*names)
+
+    def _table_exists(self, table_name: str) -> bool:
+        """先查已存在表缓存；未命中时整库表名刷新一次，其他表的后续检查随之命中缓存"""
+        with self._table_lock:
+            if table_name in self._existing_tables:
+                return True
+        self._refresh_table_list()
+        with self._table_lock:
+            return table_name in self._existing_tables
+
+    def invalidate_table_cache(self, *table_names):
+        """表被删除/重命名后，一次性从已存在表缓存中移除，并清空 Inspector 反射缓存"""
+        with self._table_lock:
+            self._existing_tables.difference_update(table_names)
+            self._ensured_tables.difference_update(table_names)
+            self._unique_key_ensured.difference_update(table_names)
+            for name in table_names:
+                self._index_cache.pop(name, None)
+            if self._inspector is not None:
+                self._inspector.clear_cache()
+
+    def tables_exist(self, table_names) -> set:
+        """一次查询返回给定表名中实际存在的那些
+
+        MySQL/MariaDB 直接查 information_schema.tables，避免逐个 has_table 的多次往返；
+        其他方言退回 Inspector 逐个检查。
+        """
+        names = list(dict.fromkeys(table_names))
+        if not names:
+            return set()
+        if self.engine.dialect.name in ('mysql', 'mariadb'):
+            query = text(
+                "SELECT table_name FROM information_schema.tables "
+                "WHERE table_schema = DATABASE() AND table_name IN :names"
+            ).bindparams(bindparam('names', expanding=True))
+            with self.engine.connect() as conn:
+                found = {row[0] for row in conn.execute(query, {'names': names})}
+        else:
+            inspector = self.get_inspector()
+            found = {name for name in names if inspector.has_table(name)}
+        self._mark_table(*found)
+        return found
+
+    def get_insert_chunksize(self, data: pd.DataFrame) -> int:
+        """多行 INSERT 的分块大小：chunksize * 列数 不超过 MySQL 单语句 65535 个占位符"""
+        max_rows = MAX_PLACEHOLDERS // max(len(data.columns), 1)
+        return max(1, min(self.insert_chunksize, max_rows))
+
+    def to_sql_kwargs(self, data: pd.DataFrame) -> dict:
+        """to_sql 的写入参数（method + chunksize）"""
+        return {'method': self.get_insert_method(), 'chunksize': self.get_insert_chunksize(data)}
+
+    def get_insert_method(self):
+        """根据数据库方言选择 to_sql 的 method 参数
+
+        MySQL/MariaDB 使用多行 INSERT；其他方言交给驱动自身的 executemany。
+        """
+        if self.engine is not None and self.engine.dialect.name in ('mysql', 'mariadb'):
+            return 'multi'
+        return None
+
     def close(self):
         """关闭数据库连接"""
         if self.engine:
@@ -417,12 +742,15 @@ class DatabaseHandler:
 
 # 全局数据库处理器实例
 _db_handler = None
+_db_handler_lock = threading.Lock()
 
 def get_db_handler() -> DatabaseHandler:
-    """获取数据库处理器实例"""
+    """获取数据库处理器实例（双重检查加锁，多线程下也只创建一个引擎/连接池）"""
     global _db_handler
     if _db_handler is None:
-        _db_handler = DatabaseHandler()
+        with _db_handler_lock:
+            if _db_handler is None:
+                _db_handler = DatabaseHandler()
     return _db_handler
 
 def get_db_engine():
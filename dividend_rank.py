@@ -9,12 +9,15 @@ import argparse
 import os
 import sys
 import logging
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 from typing import Dict, List
 import re
-from datetime import timedelta
+import shutil
 import concurrent.futures
+from functools import lru_cache
 
+import numpy as np
 import pandas as pd
 from sqlalchemy import text
 
@@ -35,6 +38,22 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 分红数据本地缓存：按当天日期分目录，同一天内重复运行直接读盘
+DIVIDEND_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "tushare-sync", "dividend_rank")
+
+# 批量查询收盘价时每条 SQL 覆盖的 (股票, 日期) 数
+PRICE_LOOKUP_CHUNK = 500
+# 除权日向前找收盘价的最大回看天数：停牌超过这个天数的不取价（不拿几个月前的价格折算）
+PRICE_LOOKBACK_DAYS = 30
+# 单条取价 SQL 失败时的重试次数
+PRICE_LOOKUP_RETRIES = 3
+
+# 分红方案中的现金分红：优先“派X元 / 派现X元 / 派现金X元”，其次任意“X元”
+CASH_PATTERNS = [
+    re.compile(r"派(?:现金?)?\s*([-+]?\d+(?:\.\d+)?)\s*元"),
+    re.compile(r"([-+]?\d+(?:\.\d+)?)\s*元"),
+]
+
 
 def detect_databases_with_stock_basic(engine) -> List[str]:
     """返回包含 stock_basic 表的数据库列表"""
@@ -66,17 +85,25 @@ def load_stocks_from_db(engine, database: str) -> pd.DataFrame:
     return df
 
 
-def normalize_stock_code(row: pd.Series) -> str:
+@lru_cache(maxsize=None)
+def normalize_stock_code(symbol, ts_code) -> str:
     """优先用 symbol，退回 ts_code（去掉交易所后缀）"""
-    symbol = (row.get("symbol") or "").strip()
+    symbol = symbol.strip() if isinstance(symbol, str) else ""
     if symbol:
         return symbol
-    ts_code = (row.get("ts_code") or "").strip()
+    ts_code = ts_code.strip() if isinstance(ts_code, str) else ""
     if ts_code and "." in ts_code:
         return ts_code.split(".", 1)[0]
     return ts_code
 
 
+def normalize_stock_codes(stocks: pd.DataFrame) -> pd.Series:
+    """normalize_stock_code 的整列版本"""
+    symbol = stocks["symbol"].fillna("").astype(str).str.strip()
+    ts_code = stocks["ts_code"].fillna("").astype(str).str.strip().str.split(".", n=1).str[0]
+    return symbol.where(symbol.str.len() > 0, ts_code)
+
+
 def parse_cash_from_plan(plan: str) -> float:
     """
     从分红方案字符串中提取现金分红数字（单位：元/10股，保持原样不换算成每股）。
@@ -84,93 +111,148 @@ def parse_cash_from_plan(plan: str) -> float:
     """
     if not isinstance(plan, str):
         return 0.0
-    # 兼容中文逗号
-    plan = plan.replace("，", ",")
-    patterns = [
-        r"派\s*([-+]?\d+(?:\.\d+)?)\s*元",
-        r"派现(?:金)?\s*([-+]?\d+(?:\.\d+)?)\s*元",
-        r"([-+]?\d+(?:\.\d+)?)\s*元",
-    ]
-    for pat in patterns:
-        match = re.search(pat, plan)
+    for pattern in CASH_PATTERNS:
+        match = pattern.search(plan)
         if match:
-            try:
-                return float(match.group(1))
-            except Exception:
-                break
+            return float(match.group(1))
     return 0.0
 
 
-def fetch_close_prices(engine, ts_code: str, trade_dates: List[str], allow_qfq_fallback: bool = False) -> Dict[str, float]:
+def parse_cash_series(plans: pd.Series) -> pd.Series:
+    """parse_cash_from_plan 的向量化版本：按 CASH_PATTERNS 的优先级整列提取"""
+    plans = plans.fillna("").astype(str)
+    extracted = pd.concat([plans.str.extract(pattern, expand=False) for pattern in CASH_PATTERNS], axis=1)
+    return extracted.bfill(axis=1).iloc[:, 0].astype(float).fillna(0.0)
+
+
+def fetch_close_prices(engine, targets: List[tuple], allow_qfq_fallback: bool = False) -> Dict[tuple, float]:
     """
-    获取指定日期及其最近交易日（向前取最近一日）的收盘价。
-    默认只用 daily（未复权）；若 allow_qfq_fallback=True 且 daily 缺失，则回退 daily_qfq。
+    批量获取 (ts_code, YYYYMMDD) 当日或向前 PRICE_LOOKBACK_DAYS 天内最近一个交易日的收盘价，
+    返回 {(ts_code, 日期): close}；窗口内没有收盘价的目标不返回。
+    向前取价交给数据库：相关子查询沿 (ts_code, trade_date) 索引只取一行，每个目标只传回一行，
+    每 PRICE_LOOKUP_CHUNK 个目标一条 SQL。
+    默认只用 daily（未复权）；若 allow_qfq_fallback=True，daily 取不到价格的目标再查 daily_qfq。
     """
-    safe_dates = [d for d in trade_dates if d and d.isdigit()]
-    if not ts_code or not safe_dates:
-        return {}
-
-    # 取查询区间：最早日期往前多留 30 天，最晚日期为最大日期
-    date_series = pd.to_datetime(safe_dates, format="%Y%m%d", errors="coerce").dropna()
-    if date_series.empty:
-        return {}
-    start_date = (date_series.min() - timedelta(days=30)).strftime("%Y%m%d")
-    end_date = date_series.max().strftime("%Y%m%d")
-
-    def _query(table: str) -> pd.DataFrame:
+
+    def _query(table: str, chunk: List[tuple]) -> Dict[tuple, float]:
+        params = {}
+        selects = []
+        for i, (ts_code, trade_date) in enumerate(chunk):
+            params[f"c{i}"] = ts_code
+            params[f"d{i}"] = trade_date
+            params[f"l{i}"] = (
+                datetime.strptime(trade_date, "%Y%m%d") - timedelta(days=PRICE_LOOKBACK_DAYS)
+            ).strftime("%Y%m%d")
+            selects.append(f"SELECT :c{i} AS ts_code, :d{i} AS target_date, :l{i} AS lower_date")
         sql = text(
             f"""
-            SELECT trade_date, close
-            FROM {table}
-            WHERE ts_code = :ts_code
-              AND trade_date BETWEEN :start_date AND :end_date
-            ORDER BY trade_date
+            SELECT t.ts_code, t.target_date,
+                   (SELECT d.close
+                    FROM {table} d
+                    WHERE d.ts_code = t.ts_code
+                      AND d.trade_date <= t.target_date
+                      AND d.trade_date >= t.lower_date
+                    ORDER BY d.trade_date DESC
+                    LIMIT 1) AS close
+            FROM ({" UNION ALL ".join(selects)}) t
             """
         )
-        try:
-            return pd.read_sql(sql, engine, params={"ts_code": ts_code, "start_date": start_date, "end_date": end_date})
-        except Exception as exc:
-            logger.warning("读取价格失败 %s %s: %s", table, ts_code, exc)
-            return pd.DataFrame()
-
-    df_price = _query("daily")
-    if df_price.empty and allow_qfq_fallback:
-        df_price = _query("daily_qfq")
-    if df_price.empty:
-        return {}
-
-    df_price["trade_date_dt"] = pd.to_datetime(df_price["trade_date"], format="%Y%m%d", errors="coerce")
-    df_price = df_price.dropna(subset=["trade_date_dt"]).sort_values("trade_date_dt")
-
-    # 对目标日期向前寻找最近的可用交易日价格
-    target_df = pd.DataFrame({"target_date": pd.to_datetime(safe_dates, format="%Y%m%d", errors="coerce")}).dropna()
-    merged = pd.merge_asof(
-        target_df.sort_values("target_date"),
-        df_price[["trade_date_dt", "close"]].rename(columns={"trade_date_dt": "trade_date_dt"}),
-        left_on="target_date",
-        right_on="trade_date_dt",
-        direction="backward",
-    )
-
-    price_map: Dict[str, float] = {}
-    for _, row in merged.iterrows():
-        if pd.notnull(row.get("close")) and pd.notnull(row.get("target_date")):
-            price_map[row["target_date"].strftime("%Y%m%d")] = float(row["close"])
-    return price_map
+        # 一条 SQL 覆盖上百只股票，失败不能当作“无价格”吞掉：重试后仍失败则抛出
+        for attempt in range(PRICE_LOOKUP_RETRIES):
+            try:
+                with engine.connect() as conn:
+                    rows = conn.execute(sql, params).all()
+                break
+            except Exception as exc:
+                if attempt == PRICE_LOOKUP_RETRIES - 1:
+                    logger.error("批量读取价格失败 %s: %s", table, exc)
+                    raise
+                logger.warning("批量读取价格失败 %s，%d 秒后重试: %s", table, attempt + 1, exc)
+                time.sleep(attempt + 1)
+        return {(ts_code, target_date): float(close) for ts_code, target_date, close in rows if close is not None}
+
+    def _query_all(table: str, table_targets: List[tuple]) -> Dict[tuple, float]:
+        prices: Dict[tuple, float] = {}
+        for i in range(0, len(table_targets), PRICE_LOOKUP_CHUNK):
+            prices.update(_query(table, table_targets[i:i + PRICE_LOOKUP_CHUNK]))
+        return prices
+
+    targets = sorted({(c, d) for c, d in targets if c and d and d.isdigit()})
+    prices = _query_all("daily", targets)
+    if allow_qfq_fallback:
+        missing = [t for t in targets if t not in prices]
+        if missing:
+            prices.update(_query_all("daily_qfq", missing))
+    logger.info("已取得 %d/%d 个除权日的收盘价", len(prices), len(targets))
+    return prices
+
+
+def _dividend_cache_path(stock_code: str) -> str:
+    """当天该股票分红缓存文件路径"""
+    return os.path.join(DIVIDEND_CACHE_DIR, datetime.now().strftime("%Y%m%d"), f"{stock_code}.parquet")
+
+
+def prune_dividend_cache() -> None:
+    """删除今天以前的分红缓存目录（缓存只在当天有效，旧目录不再会被读取）"""
+    if not os.path.isdir(DIVIDEND_CACHE_DIR):
+        return
+    today = datetime.now().strftime("%Y%m%d")
+    for name in os.listdir(DIVIDEND_CACHE_DIR):
+        path = os.path.join(DIVIDEND_CACHE_DIR, name)
+        if name < today and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+            logger.info("已删除过期分红缓存: %s", path)
+
+
+def _read_dividend_cache(path: str) -> pd.DataFrame:
+    """读取分红缓存（不存在或损坏时返回 None）"""
+    if not os.path.isfile(path):
+        return None
+    try:
+        return pd.read_parquet(path)
+    except Exception as exc:
+        logger.warning("读取分红缓存失败，将重新获取 %s: %s", path, exc)
+        return None
 
 
-def compute_dividend_by_year(
-    stock_code: str, ts_code: str, years: List[int], engine, allow_qfq_fallback: bool = False
-) -> (Dict[int, float], Dict[int, float]):
-    """获取单个股票的分红并按年度汇总：金额与对应收益率"""
+def _write_dividend_cache(path: str, df: pd.DataFrame) -> None:
+    """写入分红缓存：先写临时文件再替换，中断时不留半截文件"""
+    tmp_path = f"{path}.tmp"
     try:
-        df = adata.stock.market.get_dividend(stock_code=stock_code)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
     except Exception as exc:
-        logger.warning("获取分红失败 %s: %s", stock_code, exc)
-        return {}, {}
+        logger.warning("写入分红缓存失败 %s: %s", path, exc)
+
+
+def fetch_dividend(stock_code: str, use_cache: bool = True) -> pd.DataFrame:
+    """拉取单个股票的分红数据（纯网络 I/O，可放进线程池并发）；失败或无数据返回 None
+
+    成功的结果（含空结果）按 (股票, 当天日期) 落盘缓存，失败不缓存。
+    """
+    cache_path = _dividend_cache_path(stock_code)
+    df = _read_dividend_cache(cache_path) if use_cache else None
+    if df is None:
+        try:
+            df = adata.stock.market.get_dividend(stock_code=stock_code)
+        except Exception as exc:
+            logger.warning("获取分红失败 %s: %s", stock_code, exc)
+            return None
+        if df is None:
+            df = pd.DataFrame()
+        if use_cache:
+            _write_dividend_cache(cache_path, df)
+
+    if df.empty:
+        return None
+    return df
 
+
+def prepare_dividends(df: pd.DataFrame, years: List[int]) -> pd.DataFrame:
+    """整理单个股票的分红记录：取用日期、年份与现金分红，只保留统计年份内的记录；无数据返回 None"""
     if df is None or df.empty:
-        return {}, {}
+        return None
 
     df = df.copy()
     ex_div_dates = pd.to_datetime(df.get("ex_dividend_date"), errors="coerce")
@@ -179,30 +261,59 @@ def compute_dividend_by_year(
     # 没有任何日期的记录直接丢弃
     df = df.dropna(subset=["date_used"])
     df["year"] = df["date_used"].dt.year
-    df["cash_dividend"] = df["dividend_plan"].apply(parse_cash_from_plan)
+    df["cash_dividend"] = parse_cash_series(df["dividend_plan"])
     df["trade_date"] = df["date_used"].dt.strftime("%Y%m%d")
+    return df[(df["year"] <= years[0]) & (df["year"] >= years[-1])]
 
-    # 获取对应交易日的收盘价，计算单次分红收益率
-    price_map = fetch_close_prices(
-        engine,
-        ts_code,
-        df["trade_date"].dropna().unique().tolist(),
-        allow_qfq_fallback=allow_qfq_fallback,
+
+def compute_yield_matrix(items: List[tuple], years: List[int], prices: Dict[tuple, float]) -> np.ndarray:
+    """
+    一次性汇总所有股票各年度的分红收益率，返回 (股票数, 年数) 矩阵，行顺序与 items 一致。
+    items 为 [(ts_code, prepare_dividends 的结果)]；各股记录拼成一张表，
+    按“行号 * 年数 + 年份下标”做一次 bincount，不再逐只股票计算。无分红数据的股票为全 0 行。
+    """
+    n_years = len(years)
+    parts = [(pos, ts_code, df) for pos, (ts_code, df) in enumerate(items) if df is not None and not df.empty]
+    if not parts:
+        return np.zeros((len(items), n_years))
+
+    all_div = pd.concat([df for _, _, df in parts], ignore_index=True)
+    stock_pos = np.concatenate([np.full(len(df), pos, dtype="int64") for pos, _, df in parts])
+    ts_codes = np.concatenate([np.full(len(df), ts_code, dtype=object) for _, ts_code, df in parts])
+
+    # 对应交易日的收盘价；缺价的记录不计入，避免把收益率算成0
+    if prices:
+        keys = pd.MultiIndex.from_arrays([ts_codes, all_div["trade_date"].to_numpy(dtype=object)])
+        close_price = pd.Series(prices, dtype="float64").reindex(keys).to_numpy()
+    else:
+        close_price = np.full(len(all_div), np.nan)
+    valid = ~np.isnan(close_price)
+    cash_dividend = all_div["cash_dividend"].to_numpy(dtype="float64")
+    yield_ratio = np.divide(
+        cash_dividend, close_price * 10, out=np.zeros_like(cash_dividend), where=valid & (close_price > 0)
     )
-    df["close_price"] = df["trade_date"].map(price_map)
-    # 缺价的记录直接丢弃，避免把收益率算成0
-    df = df.dropna(subset=["close_price"])
-    df["yield_ratio"] = df.apply(
-        lambda r: (r.cash_dividend / (r.close_price * 10)) if pd.notnull(r.close_price) and r.close_price > 0 else 0.0,
-        axis=1,
+
+    # years 为倒序连续年份，years[0] - year 即该年在 years 中的下标
+    year_idx = years[0] - all_div["year"].to_numpy(dtype="int64")
+    flat = np.bincount(
+        stock_pos[valid] * n_years + year_idx[valid],
+        weights=yield_ratio[valid],
+        minlength=len(items) * n_years,
     )
+    return flat.reshape(len(items), n_years)
+
 
-    df = df[df["year"].isin(years)]
-    grouped_cash = df.groupby("year")["cash_dividend"].sum()
-    grouped_yield = df.groupby("year")["yield_ratio"].sum()
-    cash = {int(year): float(grouped_cash.get(year, 0.0)) for year in years}
-    yields = {int(year): float(grouped_yield.get(year, 0.0)) for year in years}
-    return cash, yields
+def completed_in_window(executor, fn, items, max_in_flight: int):
+    """按完成顺序产出 fn(item) 的结果，同时在途的任务不超过 max_in_flight"""
+    pending = set()
+    for item in items:
+        pending.add(executor.submit(fn, item))
+        if len(pending) >= max_in_flight:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    for future in concurrent.futures.as_completed(pending):
+        yield future.result()
 
 
 def build_report(
@@ -212,26 +323,33 @@ def build_report(
     allow_qfq_fallback: bool = False,
     workers: int = 1,
     limit: int = None,
+    use_cache: bool = True,
 ) -> pd.DataFrame:
     """遍历股票并生成分红汇总结果（单线程，每只都打印）"""
     records = []
     total_stocks = len(stocks) if not limit else min(len(stocks), limit)
     logger.info("准备处理 %s 只股票（去重后）", total_stocks)
+    if use_cache:
+        prune_dividend_cache()
 
     rows = list(stocks.itertuples(index=False))
     if limit:
         rows = rows[:limit]
 
-    def _process(row_tuple):
+    def _fetch(item):
+        # 网络 I/O 阶段：只拉取分红原始数据
+        pos, row_tuple = item
         row_dict = row_tuple._asdict()
-        code = normalize_stock_code(pd.Series(row_dict))
+        code = normalize_stock_code(row_dict.get("symbol"), row_dict.get("ts_code"))
         if not code:
-            return None, f"跳过无效代码: {row_dict}"
+            return pos, row_dict, code, None
+        return pos, row_dict, code, fetch_dividend(code, use_cache)
 
-        cash_by_year, yield_by_year = compute_dividend_by_year(
-            code, row_dict.get("ts_code", ""), years, engine, allow_qfq_fallback=allow_qfq_fallback
-        )
-        if not cash_by_year:
+    def _summarize(row_dict, code, df_div, yield_by_year):
+        # yield_by_year 为该股在 years 各年的收益率（与 years 同序）
+        if not code:
+            return None, f"跳过无效代码: {row_dict}"
+        if df_div is None:
             return None, f"无分红数据: {code} {row_dict.get('name') or ''}"
 
         record: Dict[str, object] = {
@@ -240,30 +358,55 @@ def build_report(
             "name": row_dict.get("name", "") or "",
             "source_db": row_dict.get("source_db", "") or "",
         }
-        yield_5y = sum(yield_by_year.get(y, 0.0) for y in years)
-        yield_3y = sum(yield_by_year.get(y, 0.0) for y in years[:3])
-        yield_1y = yield_by_year.get(years[0], 0.0)
+        yield_5y = float(yield_by_year.sum())
+        yield_3y = float(yield_by_year[:3].sum())
+        yield_1y = float(yield_by_year[0])
         record["yield_5y_pct"] = round(yield_5y * 100, 4)
         record["yield_3y_pct"] = round(yield_3y * 100, 4)
         record["yield_1y_pct"] = round(yield_1y * 100, 4)
         return record, None
 
+    fetched = []
+
+    def _collect(results):
+        for idx, (pos, row_dict, code, df_div) in enumerate(results, start=1):
+            fetched.append((pos, row_dict, code, prepare_dividends(df_div, years)))
+            logger.info("已拉取分红 %d/%d %s", idx, total_stocks, code)
+
+    items = enumerate(rows)
     if workers and workers > 1:
+        # 线程只负责 get_dividend 网络请求，整理计算留在主线程；
+        # 按完成顺序处理，慢的股票不会挡住后面已返回的结果
         with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
-            for idx, (record, msg) in enumerate(executor.map(_process, rows), start=1):
-                if msg:
-                    logger.info(msg)
-                if record:
-                    records.append(record)
-                logger.info("已处理 %d/%d %s %s", idx, total_stocks, record["stock_code"] if record else "", record["name"] if record else "")
+            _collect(completed_in_window(executor, _fetch, items, workers * 2))
     else:
-        for idx, row in enumerate(rows, start=1):
-            record, msg = _process(row)
-            if msg:
-                logger.info(msg)
-            if record:
-                records.append(record)
-            logger.info("已处理 %d/%d %s %s", idx, total_stocks, record["stock_code"] if record else "", record["name"] if record else "")
+        _collect(map(_fetch, items))
+    # 恢复输入顺序，输出与单线程一致
+    fetched.sort(key=lambda x: x[0])
+
+    # 所有除权日的收盘价批量查询：向前取最近交易日由数据库完成，只传回每个目标一行
+    prices = fetch_close_prices(
+        engine,
+        [
+            (row_dict.get("ts_code", "") or "", trade_date)
+            for _, row_dict, _, df_div in fetched
+            if df_div is not None
+            for trade_date in df_div["trade_date"].unique()
+        ],
+        allow_qfq_fallback=allow_qfq_fallback,
+    )
+
+    # 计算阶段：所有股票一次性汇总，留在主线程，避免 pandas 计算在多个线程间争抢 GIL
+    yield_matrix = compute_yield_matrix(
+        [(row_dict.get("ts_code", "") or "", df_div) for _, row_dict, _, df_div in fetched], years, prices
+    )
+    for idx, (_, row_dict, code, df_div) in enumerate(fetched, start=1):
+        record, msg = _summarize(row_dict, code, df_div, yield_matrix[idx - 1])
+        if msg:
+            logger.info(msg)
+        if record:
+            records.append(record)
+        logger.info("已处理 %d/%d %s %s", idx, total_stocks, record["stock_code"] if record else "", record["name"] if record else "")
 
     df = pd.DataFrame(records)
     if not df.empty:
@@ -304,6 +447,11 @@ def main():
         default=1,
         help="线程数，>1 时开启多线程提速（默认 1 单线程）",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="不读写当天的分红本地缓存，强制重新拉取",
+    )
     args = parser.parse_args()
 
     db_handler = get_db_handler()
@@ -331,7 +479,7 @@ def main():
         sys.exit(1)
 
     all_stocks = pd.concat(stock_frames, ignore_index=True)
-    all_stocks["stock_code"] = all_stocks.apply(normalize_stock_code, axis=1)
+    all_stocks["stock_code"] = normalize_stock_codes(all_stocks)
     all_stocks = all_stocks.drop_duplicates(subset=["stock_code"])
 
     current_year = datetime.now().year
@@ -344,6 +492,7 @@ def main():
         allow_qfq_fallback=args.allow_qfq_fallback,
         workers=max(1, args.workers),
         limit=args.limit,
+        use_cache=not args.no_cache,
     )
     if report_df.empty:
         logger.warning("没有可输出的分红记录")
@@ -107,7 +107,8 @@ else
         --collation-server=utf8mb4_unicode_ci \
         --default-time-zone='+8:00' \
         --binlog_expire_logs_seconds=86400 \
-        --max_binlog_size=128M    
+        --max_binlog_size=128M \
+        --local-infile=1
 fi
 
 # 等待MySQL启动
@@ -1,46 +1,93 @@
 #!/usr/bin/env python3
 """
-使用 AkShare / 新浪 & 东财分钟级行情接口, 同步最近 N 天 A 股分钟数据到 *_new 表
+使用东财分钟级行情接口, 同步最近 N 天 A 股分钟数据到 *_new 表
 """
 import os
 import sys
 import time
 from datetime import datetime, timedelta
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
-import akshare as ak
+import numpy as np
 import pandas as pd
 import requests
-from sqlalchemy import inspect
+from sqlalchemy import Column, DateTime, Double, MetaData, String, Table
 from tqdm import tqdm
 
 # 添加当前目录到 Python 路径
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from db_handler import get_db_handler  # noqa: E402
+from db_handler import check_table_name, get_db_handler  # noqa: E402
+
+# 开启 Copy-on-Write：列选择/过滤后的结果直接追加列，无需再整表 copy()
+# （pandas 3 起默认开启）
+if int(pd.__version__.split(".", 1)[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
 
 MAX_RETRIES = 3
 DEFAULT_PERIOD = 30
 VALID_PERIODS = {1, 5, 15, 30, 60}
 START_OFFSET_DAYS = 30
 ADJUST_TYPE = 1
-AK_ADJUST_MAP = {0: "", 1: "qfq", 2: "hfq"}
-DATA_SOURCE = "akshare_sina"
+DATA_SOURCE = "eastmoney"
 FAILED_FILE = "failed_stock_minute.txt"
+# 累计到该行数后才合并写库一次，减少事务与建表反射次数
+BATCH_ROWS = 50000
+OUTPUT_COLUMNS = [
+    "ts_code",
+    "trade_time",
+    "open",
+    "high",
+    "low",
+    "close",
+    "volume",
+    "amount",
+    "source",
+    "updated_at",
+]
+# 缓冲区按列存放；ts_code 每只股票只记一次，source/updated_at 整轮同一个值，
+# 写库前再统一补上
+BUFFER_COLUMNS = [
+    col for col in OUTPUT_COLUMNS if col not in ("ts_code", "source", "updated_at")
+]
+EM_KLINE_URL = "http://push2his.eastmoney.com/api/qt/stock/kline/get"
+
+# 东财接口复用同一个会话（keep-alive 连接池），避免每只股票重新建连
+_EM_SESSION = requests.Session()
 
 
 def get_table_names(period: int) -> Tuple[str, str]:
     """根据周期生成表名."""
-    table = f"stock_{period}m"
+    table = check_table_name(f"stock_{period}m")
     table_new = f"{table}_new"
     return table, table_new
 
 
-def ts_code_to_stock_code(ts_code: str) -> Optional[str]:
-    """转换 000001.SZ -> 000001."""
-    if not ts_code or "." not in ts_code:
-        return None
-    code, _ = ts_code.split(".")
-    return code
+def build_minute_table(table_name: str, metadata: MetaData) -> Table:
+    """分钟线表结构（显式声明，不再依赖 to_sql 按首批数据推断列类型）."""
+    return Table(
+        table_name,
+        metadata,
+        Column("ts_code", String(16)),
+        Column("trade_time", String(19)),
+        Column("open", Double),
+        Column("high", Double),
+        Column("low", Double),
+        Column("close", Double),
+        Column("volume", Double),
+        Column("amount", Double),
+        Column("source", String(32)),
+        Column("updated_at", DateTime),
+    )
+
+
+def ts_codes_to_stock_items(ts_codes: List[str]) -> List[Tuple[str, str]]:
+    """批量转换 000001.SZ -> (000001.SZ, 000001)，跳过不含交易所后缀的代码."""
+    codes = pd.Series(ts_codes, dtype=object)
+    parts = codes.str.split(".", n=1, expand=True)
+    if parts.shape[1] < 2:
+        return []
+    mask = parts[1].notna() & parts[0].fillna("").ne("")
+    return list(zip(codes[mask], parts.loc[mask, 0]))
 
 
 def load_stock_codes(db_handler) -> List[str]:
@@ -62,60 +109,19 @@ def calculate_time_range() -> Tuple[datetime, datetime]:
     return start, now
 
 
-def _fetch_minute_via_akshare(
-    stock_code: str,
-    start_time: datetime,
-    end_time: datetime,
-    period: int,
-) -> pd.DataFrame:
-    """调用 AkShare 的新浪分钟行情接口获取 5/15/30/60 分钟数据."""
-    if stock_code.startswith(("6", "9")):
-        symbol = f"sh{stock_code}"
-    elif stock_code.startswith(("4", "8")):
-        symbol = f"bj{stock_code}"
-    else:
-        symbol = f"sz{stock_code}"
-
-    adjust = AK_ADJUST_MAP.get(ADJUST_TYPE, "")
-    df = ak.stock_zh_a_minute(symbol=symbol, period=str(period), adjust=adjust)
-    if df is None or df.empty:
-        return pd.DataFrame()
-
-    rename_map = {
-        "day": "trade_time",
-        "open": "open",
-        "high": "high",
-        "low": "low",
-        "close": "close",
-        "volume": "volume",
-    }
-    missing_cols = [col for col in rename_map if col not in df.columns]
-    if missing_cols:
-        print(f"新浪分钟数据缺少列: {missing_cols}")
-        return pd.DataFrame()
-
-    df = df.rename(columns=rename_map)
-    df["trade_time"] = pd.to_datetime(df["trade_time"], errors="coerce")
-    df = df.dropna(subset=["trade_time"])
-    df = df[(df["trade_time"] >= start_time) & (df["trade_time"] <= end_time)]
-    if df.empty:
-        return df
-
-    numeric_cols = ["open", "high", "low", "close", "volume"]
-    for col in numeric_cols:
-        df[col] = pd.to_numeric(df[col], errors="coerce")
-    df = df.dropna(subset=["close"])
-    df["amount"] = df["close"] * df["volume"]
-    df["trade_time"] = df["trade_time"].dt.strftime("%Y-%m-%d %H:%M:%S")
-    return df[["trade_time", "open", "high", "low", "close", "volume", "amount"]]
+def _format_trade_time(series: pd.Series) -> np.ndarray:
+    """datetime64 列批量格式化为 'YYYY-MM-DD HH:MM:SS' 文本（C 层向量化）."""
+    text_values = np.datetime_as_string(series.to_numpy(dtype="datetime64[s]"), unit="s")
+    return np.char.replace(text_values, "T", " ")
 
 
-def _fetch_minute_one_minute(
+def _fetch_minute_via_em(
     stock_code: str,
     start_time: datetime,
     end_time: datetime,
+    period: int,
 ) -> pd.DataFrame:
-    """调用东财分钟接口获取 1 分钟数据."""
+    """调用东财分钟接口获取 1/5/15/30/60 分钟数据（起止时间由接口侧过滤）."""
     se_cid = 1 if stock_code.startswith("6") else 0
     beg = start_time.strftime("%Y%m%d%H%M%S")
     end = end_time.strftime("%Y%m%d%H%M%S")
@@ -123,14 +129,13 @@ def _fetch_minute_one_minute(
         "fields1": "f1,f2,f3,f4,f5,f6",
         "fields2": "f51,f52,f53,f54,f55,f56,f57,f58,f59,f60,f61,f116",
         "ut": "7eea3edcaed734bea9cbfc24409ed989",
-        "klt": "1",
+        "klt": str(period),
         "fqt": str(ADJUST_TYPE),
         "secid": f"{se_cid}.{stock_code}",
         "beg": beg,
         "end": end,
     }
-    url = "http://push2his.eastmoney.com/api/qt/stock/kline/get"
-    res = requests.get(url, params=params, timeout=15)
+    res = _EM_SESSION.get(EM_KLINE_URL, params=params, timeout=15)
     res.raise_for_status()
     data_json = res.json()
     if not data_json.get("data") or not data_json["data"].get("klines"):
@@ -165,11 +170,10 @@ def _fetch_minute_one_minute(
     numeric_cols = ["open", "high", "low", "close", "volume", "amount"]
     df["high"] = df["high"].fillna(df["close"])
     df["low"] = df["low"].fillna(df["close"])
-    for col in numeric_cols:
-        df[col] = pd.to_numeric(df[col], errors="coerce")
+    df[numeric_cols] = df[numeric_cols].apply(pd.to_numeric, errors="coerce")
     df = df.dropna(subset=["close"])
     df["volume"] = (df["volume"] * 100).astype(float)
-    df["trade_time"] = df["trade_time"].dt.strftime("%Y-%m-%d %H:%M:%S")
+    df["trade_time"] = _format_trade_time(df["trade_time"])
     return df[["trade_time", "open", "high", "low", "close", "volume", "amount"]]
 
 
@@ -179,36 +183,19 @@ def fetch_minute_data(
     start_time: datetime,
     end_time: datetime,
     period: int,
+    updated_at: datetime,
 ) -> pd.DataFrame:
-    """根据周期选择数据源."""
+    """获取单只股票分钟数据，updated_at 由调用方每轮同步统一生成."""
     last_error = None
     for attempt in range(MAX_RETRIES):
         try:
-            if period == 1:
-                df = _fetch_minute_one_minute(stock_code, start_time, end_time)
-            else:
-                df = _fetch_minute_via_akshare(
-                    stock_code, start_time, end_time, period
-                )
+            df = _fetch_minute_via_em(stock_code, start_time, end_time, period)
             if df is None or df.empty:
                 return pd.DataFrame()
-            df = df.copy()
             df["ts_code"] = ts_code
             df["source"] = DATA_SOURCE
-            df["updated_at"] = pd.Timestamp.utcnow()
-            ordered_columns = [
-                "ts_code",
-                "trade_time",
-                "open",
-                "high",
-                "low",
-                "close",
-                "volume",
-                "amount",
-                "source",
-                "updated_at",
-            ]
-            return df[ordered_columns]
+            df["updated_at"] = updated_at
+            return df[OUTPUT_COLUMNS]
         except Exception as exc:  # pylint: disable=broad-except
             last_error = exc
             time.sleep((attempt + 1) * 2)
@@ -279,23 +266,21 @@ def sync_stock_minute(
                 print("未获取到股票代码")
                 return False
 
-        stock_items: List[Tuple[str, str]] = []
-        for ts_code in stock_codes:
-            stock_code = ts_code_to_stock_code(ts_code)
-            if stock_code:
-                stock_items.append((ts_code, stock_code))
+        stock_items = ts_codes_to_stock_items(stock_codes)
 
         if not stock_items:
             print("没有可用的标的")
             return False
 
         start_time, end_time = calculate_time_range()
+        # 不带时区的 UTC 时间：带时区的值会被驱动按字符串连同偏移量发送，服务端再按会话时区换算
+        updated_at = pd.Timestamp.now("UTC").tz_localize(None).to_pydatetime()
         print(f"起始时间: {start_time.strftime('%Y-%m-%d %H:%M:%S')}")
         print(f"结束时间: {end_time.strftime('%Y-%m-%d %H:%M:%S')}")
         print(f"股票数量: {len(stock_items)}")
 
         engine = db_handler.get_engine()
-        inspector = inspect(engine)
+        inspector = db_handler.get_inspector()
         table_exists = inspector.has_table(table_new)
         if table_exists:
             print(f"{table_new} 已存在，将以追加方式写入")
@@ -308,12 +293,70 @@ def sync_stock_minute(
         failed_items: List[Tuple[str, str]] = []
         any_written = False
 
+        # 多只股票的数据按列缓冲，累计到 BATCH_ROWS 行后合并写入一次
+        col_buf: Dict[str, List[np.ndarray]] = {col: [] for col in BUFFER_COLUMNS}
+        pending_codes: List[str] = []
+        pending_counts: List[int] = []
+        pending_rows = 0
+        columns_for_index: Optional[List[str]] = None
+        minute_table: Optional[Table] = None
+
+        def flush_pending() -> Optional[str]:
+            """合并写入缓冲区，失败时返回错误原因."""
+            nonlocal table_ready, total_records, success_count, any_written, pending_rows
+            nonlocal columns_for_index, minute_table
+            if not pending_codes:
+                return None
+            batch_df = pd.DataFrame(
+                {col: np.concatenate(col_buf[col]) for col in BUFFER_COLUMNS}
+            )
+            # category: 每行只存整数编码，不再重复保存 ts_code 字符串
+            batch_df["ts_code"] = pd.Categorical(np.repeat(pending_codes, pending_counts))
+            batch_df["source"] = DATA_SOURCE
+            batch_df = batch_df[[col for col in OUTPUT_COLUMNS if col != "updated_at"]]
+            batch_codes = list(pending_codes)
+            for parts in col_buf.values():
+                parts.clear()
+            pending_codes.clear()
+            pending_counts.clear()
+            pending_rows = 0
+            try:
+                if minute_table is None:
+                    if table_ready:
+                        # 已有表只反射一次，之后复用同一个 Insert
+                        minute_table = Table(table_new, MetaData(), autoload_with=engine)
+                    else:
+                        minute_table = build_minute_table(table_new, MetaData())
+                        minute_table.create(engine)
+                        # 索引留到全部写完后再建，避免追加时逐行维护 B-tree
+                        columns_for_index = list(OUTPUT_COLUMNS)
+                        db_handler.invalidate_table_cache(table_new)
+                        table_ready = True
+                # 字典列表走 DBAPI executemany，由 PyMySQL 改写成多行 INSERT；updated_at 整批同值，作为语句参数绑定一次
+                rows = batch_df.astype(object).where(batch_df.notna(), None)
+                with engine.begin() as conn:
+                    conn.execute(
+                        minute_table.insert().values(updated_at=updated_at),
+                        rows.to_dict(orient="records"),
+                    )
+            except Exception as exc:  # pylint: disable=broad-except
+                reason = f"写入失败:{exc}"
+                for code in batch_codes:
+                    failed_items.append((code, reason))
+                return reason
+            total_records += len(batch_df)
+            success_count += len(batch_codes)
+            any_written = True
+            return None
+
         total_tasks = len(stock_items)
         with tqdm(total=total_tasks, desc="同步进度", unit="stock") as pbar:
             aborted = False
             for index, (ts_code, stock_code) in enumerate(stock_items, start=1):
                 try:
-                    df = fetch_minute_data(ts_code, stock_code, start_time, end_time, period)
+                    df = fetch_minute_data(
+                        ts_code, stock_code, start_time, end_time, period, updated_at
+                    )
                 except Exception as exc:  # pylint: disable=broad-except
                     failed_items.append((ts_code, f"请求失败:{exc}"))
                     print(f"[{index}/{total_tasks}] {ts_code} 请求失败: {exc}")
@@ -334,32 +377,34 @@ def sync_stock_minute(
                     abort_reason = "无数据"
                     break
 
-                try:
-                    if not table_ready:
-                        df.to_sql(table_new, engine, if_exists="replace", index=False)
-                        db_handler._create_indexes(table_new, df.columns.tolist())  # noqa: SLF001
-                        with db_handler._table_lock:  # noqa: SLF001
-                            db_handler._existing_tables.add(table_new)  # noqa: SLF001
-                        table_ready = True
-                    else:
-                        df.to_sql(table_new, engine, if_exists="append", index=False)
-                    total_records += len(df)
-                    success_count += 1
-                    any_written = True
-                except Exception as exc:  # pylint: disable=broad-except
-                    failed_items.append((ts_code, f"写入失败:{exc}"))
-                    print(f"[{index}/{total_tasks}] {ts_code} 写入失败: {exc}")
-                    aborted = True
-                    abort_reason = f"写入失败:{exc}"
-                    pbar.update(1)
-                    if sleep_interval > 0:
-                        time.sleep(sleep_interval)
-                    break
+                for col in BUFFER_COLUMNS:
+                    col_buf[col].append(df[col].to_numpy())
+                pending_codes.append(ts_code)
+                pending_counts.append(len(df))
+                pending_rows += len(df)
+                if pending_rows >= BATCH_ROWS:
+                    error = flush_pending()
+                    if error:
+                        print(f"[{index}/{total_tasks}] 批量写入失败: {error}")
+                        aborted = True
+                        abort_reason = error
+                        pbar.update(1)
+                        if sleep_interval > 0:
+                            time.sleep(sleep_interval)
+                        break
 
                 pbar.update(1)
                 if sleep_interval > 0:
                     time.sleep(sleep_interval)
 
+            # 写入缓冲区中剩余的数据
+            error = flush_pending()
+            if error:
+                print(f"剩余批次写入失败: {error}")
+
+            if columns_for_index:
+                db_handler._create_indexes(table_new, columns_for_index)  # noqa: SLF001
+
             if aborted:
                 remaining = stock_items[index:]
                 remaining_count = len(remaining)
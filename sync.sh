@@ -15,5 +15,4 @@ python daily.py range
 python filter_stock_basic.py #过滤掉688，920，ST
 
 # python daily.py range
-python daily_qfq.py workers 4
-python apply_table.py daily_qfq_new daily_qfq
+python daily_qfq.py workers 4 && python apply_table.py daily_qfq_new daily_qfq
@@ -393,8 +393,7 @@ def sync_concepts(concept_file: Optional[str] = None) -> bool:
     except Exception as exc:  # pylint: disable=broad-except
         print(f"删除旧表 {TABLE_NAME} 失败: {exc}")
 
-    with db_handler._table_lock:  # noqa: SLF001
-        db_handler._existing_tables.discard(TABLE_NAME)  # noqa: SLF001
+    db_handler.invalidate_table_cache(TABLE_NAME)
 
     first_batch = True
     total_records = 0
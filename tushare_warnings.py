@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+"""
+tushare 相关的警告过滤（各同步脚本共用）
+"""
+import warnings
+
+# tushare.pro.data_pro 内部调用 Series.fillna(method=...) 触发的 FutureWarning
+TUSHARE_DATA_PRO_MODULE = r"tushare\.pro\.data_pro"
+
+
+def suppress_tushare_future_warnings():
+    """注册 FutureWarning 过滤规则；已注册过则直接返回，不重复编译正则、不重复插入"""
+    for action, _message, category, module, _lineno in warnings.filters:
+        if (action == "ignore" and category is FutureWarning
+                and module is not None and module.pattern == TUSHARE_DATA_PRO_MODULE):
+            return
+    warnings.filterwarnings("ignore", category=FutureWarning, module=TUSHARE_DATA_PRO_MODULE)
+
+
+suppress_tushare_future_warnings()